@@ -0,0 +1,126 @@
+# Локальный фейковый Telegram Bot API для бенчмарков.
+# Отвечает на методы, которые использует бот, правдоподобными объектами,
+# считает вызовы по методам и умеет добавлять искусственную задержку сети.
+import asyncio
+import itertools
+import json
+from collections import Counter
+
+from aiohttp import web
+from aiogram.bot.api import TelegramAPIServer
+
+SEND_METHODS = {
+    'sendmessage': 'text',
+    'sendvideo': 'video',
+    'sendphoto': 'photo',
+    'sendsticker': 'sticker',
+    'sendvoice': 'voice',
+    'sendanimation': 'animation',
+    'senddocument': 'document',
+    'sendaudio': 'audio',
+}
+
+
+class FakeTelegramServer:
+    def __init__(self, host='127.0.0.1', port=8081, latency: float = 0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.calls = Counter()
+        # file_id, которые «протухли»: send*/getFile по ним отвечают 400
+        self.dead_file_ids = set()
+        # Статусы участников каналов: user_id -> status (по умолчанию member)
+        self.member_status = {}
+        # Апдейты (dict), которые отдаст следующий getUpdates — для проверки polling/остановки
+        self.pending_updates = []
+        self._message_ids = itertools.count(1)
+        self._runner = None
+
+    @property
+    def server(self) -> TelegramAPIServer:
+        return TelegramAPIServer.from_base(f"http://{self.host}:{self.port}")
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        app.router.add_get('/bot{token}/{method}', self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def handle(self, request: web.Request):
+        method = request.match_info['method'].lower()
+        self.calls[method] += 1
+        params = dict(await request.post())
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method in SEND_METHODS:
+            kind = SEND_METHODS[method]
+            file_id = params.get(kind)
+            if file_id in self.dead_file_ids:
+                return self._error(400, "Bad Request: wrong file identifier/HTTP URL specified")
+            return self._ok(self._message(params, kind, file_id))
+        if method == 'getfile':
+            file_id = params.get('file_id')
+            if file_id in self.dead_file_ids:
+                return self._error(400, "Bad Request: invalid file_id")
+            return self._ok({'file_id': file_id, 'file_unique_id': f"u{file_id}", 'file_size': 1024,
+                             'file_path': f"files/{file_id}"})
+        if method == 'getchatmember':
+            user_id = int(params.get('user_id', 0))
+            return self._ok({'status': self.member_status.get(user_id, 'member'),
+                             'user': {'id': user_id, 'is_bot': False, 'first_name': 'bench'}})
+        if method == 'getchat':
+            # Каналы в бенче — @username, id выводим из имени детерминированно
+            username = params.get('chat_id', '')
+            return self._ok({'id': -1000000000000 - sum(map(ord, username)), 'type': 'channel',
+                             'title': username, 'username': username.lstrip('@')})
+        if method == 'getme':
+            return self._ok({'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'})
+        if method == 'editmessagereplymarkup':
+            return self._ok(True)
+        if method == 'editmessagetext':
+            message = self._message(params, 'text', None)
+            message['message_id'] = int(params.get('message_id', 0))
+            return self._ok(message)
+        if method in ('answercallbackquery', 'deletemessage', 'setmycommands', 'deletewebhook'):
+            return self._ok(True)
+        if method == 'getupdates':
+            updates, self.pending_updates = self.pending_updates, []
+            return self._ok(updates)
+        return self._error(404, f"Not Found: method {method} is not emulated")
+
+    def _message(self, params, kind, file_id):
+        chat_id = int(params.get('chat_id', 0))
+        message = {
+            'message_id': next(self._message_ids),
+            'date': 0,
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': 1, 'is_bot': True, 'first_name': 'bench'},
+        }
+        if kind == 'text':
+            message['text'] = params.get('text', '')
+        elif kind == 'photo':
+            message['photo'] = [{'file_id': file_id, 'file_unique_id': f"u{file_id}", 'width': 1, 'height': 1}]
+        elif kind == 'sticker':
+            message['sticker'] = {'file_id': file_id, 'file_unique_id': f"u{file_id}", 'width': 1, 'height': 1,
+                                  'is_animated': False, 'is_video': False, 'type': 'regular'}
+        else:
+            message[kind] = {'file_id': file_id, 'file_unique_id': f"u{file_id}", 'duration': 1}
+        if 'reply_markup' in params:
+            message['reply_markup'] = json.loads(params['reply_markup'])
+        return message
+
+    @staticmethod
+    def _ok(result):
+        return web.json_response({'ok': True, 'result': result})
+
+    @staticmethod
+    def _error(status, description):
+        return web.json_response({'ok': False, 'error_code': status, 'description': description}, status=status)
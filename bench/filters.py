@@ -0,0 +1,102 @@
+# Микробенчмарк стоимости фильтров на один апдейт: повторяет цикл
+# Handler.notify (проверка фильтров по порядку до первого совпадения)
+# для текущих хендлеров dp и для старой схемы из лямбд со split('_').
+#
+#   python -m bench.filters --iterations 20000
+import argparse
+import asyncio
+import os
+import sys
+from time import perf_counter
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram.dispatcher.filters import check_filters, FilterNotPassed
+
+from bench.run import callback_update, message_update
+
+CALLBACK_SAMPLES = ['check_subscription', 'like_video_42', 'dislike_meme_7', 'next_sticker']
+MESSAGE_SAMPLES = ['🎥 Видео', '🍀 Узнать уровень удачи', 'просто текст']
+
+# Прежние фильтры колбэков в порядке регистрации
+LEGACY_CALLBACK_FILTERS = [
+    lambda c: c.data == 'check_subscription',
+    lambda c: c.data.startswith(('like_', 'dislike_')),
+    lambda c: c.data.startswith(('like_', 'dislike_', 'next_')),
+]
+
+
+def legacy_dispatcher(bot):
+    dp = Dispatcher(bot, storage=MemoryStorage())
+    for check in LEGACY_CALLBACK_FILTERS:
+        dp.register_callback_query_handler(legacy_handler, check)
+    return dp
+
+
+async def legacy_handler(callback_query):
+    pass
+
+
+def legacy_parse(data):
+    parts = data.split('_')
+    return parts[0], parts[1], int(parts[2]) if len(parts) > 2 else 0
+
+
+async def match_cost(handler, obj, iterations, parse=None):
+    # Среднее время (мкс) проверки фильтров до первого подходящего хендлера
+    # плюс разбор callback_data, если он нужен
+    start = perf_counter()
+    for _ in range(iterations):
+        for handler_obj in handler.handlers:
+            try:
+                await check_filters(handler_obj.filters, (obj,))
+            except FilterNotPassed:
+                continue
+            break
+        if parse is not None:
+            parse(obj.data)
+    return (perf_counter() - start) / iterations * 1e6
+
+
+def legacy_parse_if_content(data):
+    if data != 'check_subscription':
+        legacy_parse(data)
+
+
+async def main(args):
+    import tgaiogrambot as bot_module
+    from callbacks import pack_callback, unpack_callback
+
+    Bot.set_current(bot_module.bot)
+    Dispatcher.set_current(bot_module.dp)
+    dp = bot_module.dp
+    legacy_dp = legacy_dispatcher(bot_module.bot)
+
+    print(f"{'callback_data':<22} {'legacy us':>10} {'router us':>10}")
+    for data in CALLBACK_SAMPLES:
+        legacy = callback_update(types, 1, data).callback_query
+        route = unpack_callback(data)
+        packed = pack_callback(*route) if route else data
+        current = callback_update(types, 1, packed).callback_query
+        types.User.set_current(current.from_user)
+        types.Chat.set_current(current.message.chat)
+        legacy_cost = await match_cost(legacy_dp.callback_query_handlers, legacy, args.iterations,
+                                       legacy_parse_if_content)
+        router_cost = await match_cost(dp.callback_query_handlers, current, args.iterations, unpack_callback)
+        print(f"{data:<22} {legacy_cost:>10.2f} {router_cost:>10.2f}")
+
+    print(f"\n{'message text':<22} {'filters us':>10}")
+    for text in MESSAGE_SAMPLES:
+        message = message_update(types, 1, text).message
+        types.User.set_current(message.from_user)
+        types.Chat.set_current(message.chat)
+        print(f"{text:<22} {await match_cost(dp.message_handlers, message, args.iterations):>10.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Filter evaluation cost per update.")
+    parser.add_argument('--iterations', type=int, default=20000)
+    os.environ.setdefault("BOT_TOKEN", "123456:bench-token")
+    os.environ.setdefault("DATABASE_URL", "postgresql://localhost/bench")
+    os.environ.setdefault("METRICS_PORT", "0")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,52 @@
+# Бенчмарк пакетного расчёта рекомендаций на синтетических голосах
+# (по умолчанию 1M строк user_feedback, популярность контента по Ципфу).
+# База не нужна: меряется только счёт в памяти и пиковое потребление.
+#
+#   python -m bench.recommend --rows 1000000 --memory-mb 256
+import argparse
+import resource
+import sys
+import tracemalloc
+from time import perf_counter
+
+import numpy as np
+
+from recommend import compute_recommendations
+
+
+def synthetic_feedback(rows, users, items, seed):
+    rng = np.random.default_rng(seed)
+    user_idx = rng.integers(0, users, rows, dtype=np.int32)
+    # Популярные единицы контента получают непропорционально много голосов
+    item_idx = ((rng.zipf(1.3, rows) - 1) % items).astype(np.int32)
+    values = np.where(rng.random(rows) < 0.8, 1, -1).astype(np.int8)
+    return user_idx, item_idx, values
+
+
+def main(args):
+    user_idx, item_idx, values = synthetic_feedback(args.rows, args.users, args.items, args.seed)
+    tracemalloc.start()
+    start = perf_counter()
+    rec_users, _, _, _ = compute_recommendations(user_idx, item_idx, values, args.users, args.items,
+                                                 top_k=args.top_k, neighbors=args.neighbors,
+                                                 memory_mb=args.memory_mb)
+    elapsed = perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"rows={args.rows} users={args.users} items={args.items} budget={args.memory_mb}MB")
+    print(f"time={elapsed:.2f}s recommendations={len(rec_users)} "
+          f"peak_traced={peak / 1024 / 1024:.1f}MB max_rss={max_rss:.1f}MB")
+    return 0 if peak <= args.memory_mb * 1024 * 1024 * 1.5 else 1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Collaborative filtering batch benchmark.")
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--items', type=int, default=20_000)
+    parser.add_argument('--top-k', type=int, default=20)
+    parser.add_argument('--neighbors', type=int, default=50)
+    parser.add_argument('--memory-mb', type=int, default=256)
+    parser.add_argument('--seed', type=int, default=42)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,348 @@
+# Нагрузочные сценарии для бота: настоящие хендлеры dp, синтетические Update,
+# локальный фейковый Bot API (bench/fake_telegram.py) и локальный Postgres.
+#
+# ВНИМАНИЕ: таблицы в BENCH_DATABASE_URL очищаются перед прогоном.
+#
+#   BENCH_DATABASE_URL=postgresql://postgres@localhost/bench python -m bench.run
+#   python -m bench.run --scenario menu,vote --updates 5000 --json bench.json
+#   python -m bench.run --baseline bench.json   # код выхода 1 при регрессии
+import argparse
+import asyncio
+import importlib
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+from time import perf_counter
+
+from aiogram import Bot, Dispatcher
+
+from bench.fake_telegram import FakeTelegramServer
+from content_types import CONTENT_TABLES
+
+SCENARIOS = ('menu', 'next', 'vote', 'broadcast', 'cron', 'dead', 'validate', 'flood')
+MENU_BUTTONS = ['🎥 Видео', '🖼️ Мемы', '📦 Стикеры', '🎙️ Голосовухи', '🍀 Узнать уровень удачи']
+BASE_USER_ID = 10_000_000
+
+_update_ids = itertools.count(1)
+
+
+def message_update(types, user_id, text):
+    message = {
+        'message_id': next(_update_ids),
+        'date': 0,
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'bench', 'username': f"bench{user_id}"},
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return types.Update(update_id=next(_update_ids), message=message)
+
+
+def callback_update(types, user_id, data, chat_id=None, message_id=None):
+    # По умолчанию кнопка под сообщением в личке пользователя
+    return types.Update(update_id=next(_update_ids), callback_query={
+        'id': str(next(_update_ids)),
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'bench'},
+        'chat_instance': '1',
+        'data': data,
+        'message': {
+            'message_id': message_id or next(_update_ids),
+            'date': 0,
+            'chat': {'id': chat_id or user_id, 'type': 'private' if chat_id is None else 'group'},
+            'from': {'id': 1, 'is_bot': True, 'first_name': 'bench'},
+            'text': 'content',
+        },
+    })
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def summarize(name, latencies, elapsed, ops, errors, calls):
+    return {
+        'scenario': name,
+        'updates': len(latencies),
+        'ops': ops,
+        'errors': errors,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'max_ms': max(latencies, default=0.0) * 1000,
+        'throughput': ops / elapsed if elapsed else 0.0,
+        'api_calls': dict(calls),
+    }
+
+
+async def settle(bot_module):
+    # Дожидаемся работы, ушедшей в фон: отложенных правок и фоновых задач
+    await bot_module.edit_scheduler.flush()
+    await bot_module.background.drain(timeout=300)
+
+
+async def drive(dp, updates, concurrency, settled=None):
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def process(update):
+        nonlocal errors
+        async with semaphore:
+            start = perf_counter()
+            try:
+                await dp.process_updates([update])
+            except Exception as e:
+                errors += 1
+                logging.debug(f"Update {update.update_id} failed: {e}")
+            latencies.append(perf_counter() - start)
+
+    start = perf_counter()
+    await asyncio.gather(*(process(update) for update in updates))
+    if settled is not None:
+        # Пропускная способность считается с учётом работы, ушедшей в фон
+        await settled
+    return latencies, perf_counter() - start, errors
+
+
+async def seed(pool, content, users):
+    async with pool.acquire() as conn:
+        await conn.execute(f"""
+            TRUNCATE {', '.join(CONTENT_TABLES.values())}, user_content, user_content_seen,
+                     content_feedback, user_feedback, bot_users, user_recommendations RESTART IDENTITY
+        """)
+        for content_type, table_name in CONTENT_TABLES.items():
+            await conn.execute(f"""
+                INSERT INTO {table_name} ({content_type}_id)
+                SELECT 'bench-{content_type}-' || g FROM generate_series(1, $1) g
+            """, content)
+        await conn.execute("""
+            INSERT INTO bot_users (user_id, username)
+            SELECT g, 'bench' || g FROM generate_series($1::BIGINT, $1::BIGINT + $2 - 1) g
+        """, BASE_USER_ID, users)
+
+
+async def warm_ranking(bot_module):
+    # В боте это делает фоновая задача ranking.run()
+    for content_type in CONTENT_TABLES:
+        async with bot_module.db_pool.acquire() as conn:
+            await bot_module.ranking.load(conn, content_type)
+        await bot_module.ranking.rebuild(content_type)
+
+
+async def warm_recommendations(bot_module, users, content):
+    # Голоса с историей, чтобы было из чего считать рекомендации; в боте пересчёт идёт по RECOMMEND_CRON
+    import recommend
+    async with bot_module.db_pool.acquire() as conn:
+        for content_type in CONTENT_TABLES:
+            await conn.execute("""
+                INSERT INTO user_feedback (user_id, content_id, content_type, feedback_type)
+                SELECT u, 'bench-' || $3 || '-' || ((u * 7 + k * 13) % $2 + 1), $3,
+                       CASE WHEN k % 5 = 0 THEN 'dislike' ELSE 'like' END
+                FROM generate_series($4::BIGINT, $4::BIGINT + $1 - 1) u, generate_series(1, 10) k
+                ON CONFLICT DO NOTHING
+            """, users, content, content_type, BASE_USER_ID)
+    await recommend.run_batch(bot_module.db_pool)
+
+
+def kill_files(fake, rng, content, ratio):
+    # Часть file_id в каталоге «протухает»: send*/getFile отвечают 400
+    for content_type in CONTENT_TABLES:
+        for i in range(1, content + 1):
+            if rng.random() < ratio:
+                fake.dead_file_ids.add(f"bench-{content_type}-{i}")
+
+
+async def count_dead(bot_module):
+    async with bot_module.db_pool.acquire() as conn:
+        return sum([await conn.fetchval(f"SELECT COUNT(*) FROM {table_name} WHERE dead_at IS NOT NULL")
+                    for table_name in CONTENT_TABLES.values()])
+
+
+async def run_scenario(name, bot_module, args, fake):
+    from callbacks import pack_callback
+    types = bot_module.types
+    dp = bot_module.dp
+    rng = random.Random(args.seed)
+    user = lambda: BASE_USER_ID + rng.randrange(args.users)  # noqa: E731
+
+    if name == 'menu':
+        updates = [message_update(types, user(), rng.choice(MENU_BUTTONS)) for _ in range(args.updates)]
+    elif name == 'next':
+        updates = [callback_update(types, user(), pack_callback('next', rng.choice(list(CONTENT_TABLES))))
+                   for _ in range(args.updates)]
+    elif name == 'vote':
+        # Шторм голосов по нескольким «вирусным» единицам контента:
+        # половина в личках, половина под одним сообщением в группе
+        hot = [rng.randint(1, args.content) for _ in range(5)]
+        updates = []
+        for i in range(args.updates):
+            uid = rng.choice(hot)
+            in_group = i % 2 == 0
+            updates.append(callback_update(types, BASE_USER_ID + i % args.users,
+                                           pack_callback(rng.choice(('like', 'dislike')), 'video', uid),
+                                           chat_id=-100 if in_group else None,
+                                           message_id=uid if in_group else None))
+    elif name == 'broadcast':
+        admin = min(bot_module.ALLOWED_USERS)
+        await dp.process_updates([message_update(types, admin, '/otpravka')])
+        updates = [message_update(types, admin, f"bench broadcast {i}") for i in range(args.broadcasts)]
+        latencies, elapsed, errors = await drive(dp, updates, 1)
+        await dp.process_updates([message_update(types, admin, '/stop')])
+        return latencies, elapsed, errors, args.users * len(updates)
+    elif name == 'flood':
+        # Один пользователь долбит «Следующее», остальные пользуются ботом как обычно:
+        # лишние нажатия должны отсекаться до send_content
+        spammer = BASE_USER_ID
+        updates = [callback_update(types, spammer if i % 10 else user(),
+                                   pack_callback('next', rng.choice(list(CONTENT_TABLES))))
+                   for i in range(args.updates)]
+    elif name == 'dead':
+        # Выдача при мёртвых file_id, о которых валидатор ещё не знает: send_content
+        # должен пропускать их и отправлять другую единицу контента
+        kill_files(fake, rng, args.content, args.dead_ratio)
+        updates = [message_update(types, user(), rng.choice(MENU_BUTTONS[:4])) for _ in range(args.updates)]
+    elif name == 'validate':
+        # Полный проход валидатора по каталогу; ошибка — если помечено не столько, сколько «умерло»
+        kill_files(fake, rng, args.content, args.dead_ratio)
+        validator = bot_module.file_validator
+        validator.batch = 500
+        start = perf_counter()
+        checked = 0
+        for content_type in CONTENT_TABLES:
+            while True:
+                done = await validator.validate_batch(bot_module.db_pool, content_type)
+                if not done:
+                    break
+                checked += done
+        elapsed = perf_counter() - start
+        errors = abs(await count_dead(bot_module) - len(fake.dead_file_ids))
+        return [elapsed], elapsed, errors, checked
+    elif name == 'cron':
+        start = perf_counter()
+        errors = 0
+        # @aiocron.crontab оборачивает функцию в объект Cron
+        job = bot_module.scheduled_daily_video
+        try:
+            await getattr(job, 'func', job)()
+        except Exception as e:
+            errors += 1
+            logging.error(f"Cron scenario failed: {e}")
+        elapsed = perf_counter() - start
+        return [elapsed], elapsed, errors, args.users
+    else:
+        raise ValueError(f"Unknown scenario: {name}")
+
+    latencies, elapsed, errors = await drive(dp, updates, args.concurrency, settle(bot_module))
+    return latencies, elapsed, errors, len(updates)
+
+
+def print_report(results):
+    print(f"{'scenario':<10} {'updates':>8} {'errors':>7} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9} {'ops/s':>10}")
+    for r in results:
+        print(f"{r['scenario']:<10} {r['updates']:>8} {r['errors']:>7} {r['p50_ms']:>9.2f} {r['p99_ms']:>9.2f} "
+              f"{r['max_ms']:>9.2f} {r['throughput']:>10.1f}")
+    for r in results:
+        calls = ', '.join(f"{method}={count}" for method, count in sorted(r['api_calls'].items()))
+        print(f"  {r['scenario']}: {calls or 'no API calls'}")
+
+
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {r['scenario']: r for r in json.load(f)}
+    regressions = []
+    for r in results:
+        base = baseline.get(r['scenario'])
+        if not base:
+            continue
+        if base['p99_ms'] and r['p99_ms'] > base['p99_ms'] * (1 + tolerance):
+            regressions.append(f"{r['scenario']}: p99 {base['p99_ms']:.2f} -> {r['p99_ms']:.2f} ms")
+        if base['throughput'] and r['throughput'] < base['throughput'] * (1 - tolerance):
+            regressions.append(f"{r['scenario']}: throughput {base['throughput']:.1f} -> {r['throughput']:.1f} ops/s")
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    return not regressions
+
+
+async def main(args):
+    fake = FakeTelegramServer(port=args.api_port, latency=args.api_latency_ms / 1000)
+    await fake.start()
+
+    bot_module = importlib.import_module('tgaiogrambot')
+    bot_module.bot.server = fake.server
+    Bot.set_current(bot_module.bot)
+    Dispatcher.set_current(bot_module.dp)
+    logging.getLogger().setLevel(args.log_level)
+
+    await bot_module.init_db_pool()
+    await bot_module.create_tables()
+    await bot_module.update_tables()
+
+    results = []
+    try:
+        for name in args.scenario:
+            await seed(bot_module.db_pool, args.content, args.users)
+            if bot_module.CONTENT_SELECTION == 'recommended':
+                await warm_recommendations(bot_module, args.users, args.content)
+            if bot_module.CONTENT_SELECTION in ('ranked', 'recommended'):
+                await warm_ranking(bot_module)
+            fake.dead_file_ids.clear()
+            before = fake.calls.copy()
+            latencies, elapsed, errors, ops = await run_scenario(name, bot_module, args, fake)
+            results.append(summarize(name, latencies, elapsed, ops, errors, fake.calls - before))
+    finally:
+        await bot_module.close_db_pool()
+        await (await bot_module.bot.get_session()).close()
+        await fake.stop()
+
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        return 0 if compare(results, args.baseline, args.tolerance) else 1
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the bot handlers.")
+    parser.add_argument('--scenario', default='all',
+                        help=f"comma separated list of {', '.join(SCENARIOS)} or 'all'")
+    parser.add_argument('--updates', type=int, default=2000, help="updates per scenario")
+    parser.add_argument('--concurrency', type=int, default=50, help="updates processed at once")
+    parser.add_argument('--users', type=int, default=1000, help="bot_users rows / distinct senders")
+    parser.add_argument('--content', type=int, default=5000, help="rows per content table")
+    parser.add_argument('--broadcasts', type=int, default=1, help="messages sent in /otpravka scenario")
+    parser.add_argument('--api-latency-ms', type=float, default=0.0, help="fake Bot API response delay")
+    parser.add_argument('--api-port', type=int, default=8081)
+    parser.add_argument('--api-rate', type=float, default=1000.0,
+                        help="API_RATE_LIMIT for the bot (real Telegram allows ~30/s)")
+    parser.add_argument('--dead-ratio', type=float, default=0.3,
+                        help="share of file_ids the fake API reports as dead in dead/validate")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--log-level', default='ERROR')
+    parser.add_argument('--json', help="write results to this file")
+    parser.add_argument('--baseline', help="compare with results previously written by --json")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args(argv)
+    args.scenario = list(SCENARIOS) if args.scenario == 'all' else args.scenario.split(',')
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    database_url = os.getenv("BENCH_DATABASE_URL")
+    if not database_url:
+        sys.exit("BENCH_DATABASE_URL must point to a disposable Postgres database")
+    # Бот читает конфигурацию из окружения при импорте
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("BOT_TOKEN", "123456:bench-token")
+    os.environ.setdefault("METRICS_PORT", "0")
+    os.environ["API_RATE_LIMIT"] = str(args.api_rate)
+    os.environ["FILE_CHECK_RATE"] = str(args.api_rate)
+    sys.exit(asyncio.run(main(args)))
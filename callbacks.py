@@ -0,0 +1,42 @@
+# Компактный формат callback_data для кнопок под контентом.
+# Строка фиксированной ширины: версия, код действия, код типа контента и id
+# в hex на 8 символов, например "1lv0000002a" — лайк видео с id=42.
+# Кнопки в уже отправленных сообщениях остаются в старом формате
+# "like_video_42" / "next_video", поэтому unpack_callback понимает и его.
+from content_types import CONTENT_TYPES
+
+CALLBACK_VERSION = '1'
+ID_WIDTH = 8
+PACKED_LENGTH = 3 + ID_WIDTH
+
+ACTION_CODES = {'like': 'l', 'dislike': 'd', 'next': 'n'}
+TYPE_CODES = {name: content_type.code for name, content_type in CONTENT_TYPES.items()}
+
+_ACTIONS = {code: action for action, code in ACTION_CODES.items()}
+_TYPES = {code: content_type for content_type, code in TYPE_CODES.items()}
+
+
+def pack_callback(action: str, content_type: str, uid: int = 0) -> str:
+    return f"{CALLBACK_VERSION}{ACTION_CODES[action]}{TYPE_CODES[content_type]}{uid:0{ID_WIDTH}x}"
+
+
+def unpack_callback(data: str):
+    # Возвращает (action, content_type, uid) или None для чужих данных
+    if len(data) == PACKED_LENGTH and data[0] == CALLBACK_VERSION:
+        action = _ACTIONS.get(data[1])
+        content_type = _TYPES.get(data[2])
+        if action is None or content_type is None:
+            return None
+        try:
+            return action, content_type, int(data[3:], 16)
+        except ValueError:
+            return None
+
+    parts = data.split('_')
+    if len(parts) < 2 or parts[0] not in ACTION_CODES or parts[1] not in TYPE_CODES:
+        return None
+    if parts[0] == 'next':
+        return 'next', parts[1], 0
+    if len(parts) != 3 or not parts[2].isdigit():
+        return None
+    return parts[0], parts[1], int(parts[2])
@@ -0,0 +1,112 @@
+# Фоновое удаление контента из каталога.
+# Удаляем пачками по id (keyset по первичному ключу), каждая пачка — отдельная
+# короткая транзакция, между пачками пауза: блокировки не держатся долго,
+# автовакуум успевает, а бот продолжает отвечать. Вместе с контентом чистятся
+# зависимые строки: счётчики content_feedback, голоса user_feedback и отметки
+# «уже видел» user_content_seen. Журнал просмотров user_content не трогаем —
+# его старые секции удаляет retention.py, а на выбор контента он не влияет.
+import asyncio
+import logging
+from time import monotonic
+
+logger = logging.getLogger(__name__)
+
+
+class DeletionJob:
+    def __init__(self, content_type: str, table_name: str, min_id: int = None, max_id: int = None,
+                 older_than_days: int = None, batch_size: int = 500, pause: float = 0.2):
+        self.content_type = content_type
+        self.table_name = table_name
+        self.min_id = min_id
+        self.max_id = max_id
+        self.older_than_days = older_than_days
+        self.batch_size = batch_size
+        self.pause = pause
+        self.total = 0
+        self.deleted = 0
+        self.started = None
+        self.finished = None
+        self.task = None
+
+    def describe(self) -> str:
+        parts = [self.content_type]
+        if self.min_id is not None or self.max_id is not None:
+            parts.append(f"id {self.min_id or 1}-{self.max_id or '∞'}")
+        if self.older_than_days is not None:
+            parts.append(f"старше {self.older_than_days} дн.")
+        return ", ".join(parts)
+
+    def progress(self) -> str:
+        elapsed = (self.finished or monotonic()) - self.started if self.started else 0
+        rate = self.deleted / elapsed if elapsed else 0
+        return f"{self.describe()}: удалено {self.deleted} из {self.total} ({rate:.0f}/с)"
+
+    def _filter(self):
+        # Условия отбора; $1 в запросах занят курсором по id
+        conditions, args = [], []
+        if self.min_id is not None:
+            args.append(self.min_id)
+            conditions.append(f"id >= ${len(args) + 1}")
+        if self.max_id is not None:
+            args.append(self.max_id)
+            conditions.append(f"id <= ${len(args) + 1}")
+        if self.older_than_days is not None:
+            args.append(self.older_than_days)
+            # NULL — контент старше колонки created_at, то есть заведомо старый
+            conditions.append(f"(created_at IS NULL OR created_at < NOW() - ${len(args) + 1} * INTERVAL '1 day')")
+        return "".join(f" AND {c}" for c in conditions), args
+
+    async def count(self, conn):
+        where, args = self._filter()
+        self.total = await conn.fetchval(f"SELECT COUNT(*) FROM {self.table_name} WHERE id > $1{where}", 0, *args)
+        return self.total
+
+    async def delete_batch(self, conn, after: int):
+        # Возвращает последний удалённый id или None, если удалять больше нечего
+        where, args = self._filter()
+        limit = f"${len(args) + 2}"
+        async with conn.transaction():
+            rows = await conn.fetch(f"""
+                DELETE FROM {self.table_name} WHERE id IN (
+                    SELECT id FROM {self.table_name} WHERE id > $1{where} ORDER BY id LIMIT {limit}
+                )
+                RETURNING id, {self.content_type}_id AS content_id
+            """, after, *args, self.batch_size)
+            if not rows:
+                return None
+            # Дубликаты file_id в каталоге возможны: зависимые строки чистим, только если копий не осталось
+            orphans = await conn.fetch(f"""
+                SELECT c FROM unnest($1::TEXT[]) c
+                WHERE NOT EXISTS (SELECT 1 FROM {self.table_name} WHERE {self.content_type}_id = c)
+            """, list({row['content_id'] for row in rows}))
+            orphans = [row[0] for row in orphans]
+            if orphans:
+                await conn.execute("""
+                    DELETE FROM content_feedback WHERE content_type = $1 AND content_id = ANY($2::TEXT[])
+                """, self.content_type, orphans)
+                await conn.execute("""
+                    DELETE FROM user_feedback WHERE content_type = $1 AND content_id = ANY($2::TEXT[])
+                """, self.content_type, orphans)
+                await conn.execute("""
+                    DELETE FROM user_content_seen WHERE content_type = $1 AND content_id = ANY($2::TEXT[])
+                """, self.content_type, orphans)
+        self.deleted += len(rows)
+        return max(row['id'] for row in rows)
+
+    async def run(self, pool, on_progress=None):
+        self.started = monotonic()
+        last_id = 0
+        try:
+            while True:
+                # Соединение берём на одну пачку, чтобы не занимать пул во время пауз
+                async with pool.acquire() as conn:
+                    last_id = await self.delete_batch(conn, last_id)
+                if last_id is None:
+                    break
+                if on_progress:
+                    await on_progress(self)
+                await asyncio.sleep(self.pause)
+        finally:
+            self.finished = monotonic()
+        logger.info(f"Удаление завершено — {self.progress()}")
+        return self.deleted
@@ -0,0 +1,92 @@
+# Реестр типов контента: всё, что зависит от типа, описано здесь один раз,
+# а горячие пути (send_content, add_content, рассылка, колбэки) делают один
+# поиск в словаре вместо цепочек if/elif.
+# Новый тип (например, GIF: ContentType("gif", "gifs", "g", "animation")) —
+# одна запись в CONTENT_TYPES; таблицу создаст create_tables (не забыть поднять
+# SCHEMA_VERSION), плюс команда и кнопка меню в боте.
+
+
+class MediaKind:
+    # Вид вложения Telegram: поле Message (оно же message.content_type), метод
+    # отправки send_<вид> и принимает ли он подпись
+    def __init__(self, attribute: str, caption: bool = True):
+        self.attribute = attribute
+        self.method = f"send_{attribute}"
+        self.caption = caption
+
+    def file_id(self, message):
+        media = getattr(message, self.attribute, None)
+        if not media:
+            return None
+        # У фото список размеров — берём самый большой
+        if isinstance(media, list):
+            media = media[-1]
+        return media.file_id
+
+    def send(self, bot, chat_id, file_id, caption=None, **kwargs):
+        if caption is not None and self.caption:
+            kwargs['caption'] = caption
+        return getattr(bot, self.method)(chat_id, file_id, **kwargs)
+
+
+MEDIA_KINDS = {
+    kind.attribute: kind for kind in (
+        MediaKind("photo"),
+        MediaKind("video"),
+        MediaKind("animation"),
+        MediaKind("document"),
+        MediaKind("audio"),
+        MediaKind("voice"),
+        MediaKind("sticker", caption=False),
+    )
+}
+
+
+class ContentType:
+    def __init__(self, name: str, table: str, code: str, media: str):
+        self.name = name
+        self.table = table
+        # Колонка с file_id; имя <тип>_id используют и ranking/recommend/cleanup/validator
+        self.column = f"{name}_id"
+        # Однобуквенный код в callback_data (см. callbacks.py)
+        self.code = code
+        self.media = MEDIA_KINDS[media]
+        # Тексты запросов собраны заранее: одинаковый текст — одна запись в кэше asyncpg
+        self.create_query = f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                id SERIAL PRIMARY KEY,
+                {self.column} TEXT NOT NULL
+            )
+        """
+        self.by_id_query = f"SELECT id, {self.column} FROM {table} WHERE id = $1 AND dead_at IS NULL"
+        self.file_id_query = f"SELECT {self.column} FROM {table} WHERE id = $1"
+        self.random_query = f"""
+            SELECT v.id, v.{self.column} FROM {table} v
+            LEFT JOIN user_content_seen uc
+            ON v.{self.column} = uc.content_id
+            AND uc.user_id = $1
+            AND uc.content_type = $2
+            AND uc.source = $3
+            WHERE uc.content_id IS NULL AND v.dead_at IS NULL
+            ORDER BY RANDOM() LIMIT 1
+        """
+        self.insert_query = f"INSERT INTO {table} ({self.column}) VALUES ($1) ON CONFLICT DO NOTHING"
+
+    def file_id(self, message):
+        return self.media.file_id(message)
+
+    def send(self, bot, chat_id, file_id, **kwargs):
+        return self.media.send(bot, chat_id, file_id, **kwargs)
+
+
+CONTENT_TYPES = {
+    content_type.name: content_type for content_type in (
+        ContentType("video", "videos", "v", "video"),
+        ContentType("meme", "memes", "m", "photo"),
+        ContentType("sticker", "stickers", "s", "sticker"),
+        ContentType("voice", "voice_messages", "o", "voice"),
+    )
+}
+
+# Типы контента и таблицы, в которых они хранятся
+CONTENT_TABLES = {name: content_type.table for name, content_type in CONTENT_TYPES.items()}
@@ -0,0 +1,87 @@
+# Отложенная правка клавиатур под контентом.
+# Голоса по одному сообщению за короткое окно схлопываются в один
+# edit_message_reply_markup с последними счётчиками; правки без изменений
+# не отправляются вовсе.
+import asyncio
+import logging
+from collections import OrderedDict
+
+from aiogram.utils.exceptions import MessageNotModified, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+
+class EditScheduler:
+    def __init__(self, bot, limiter, delay: float = 1.0, remember: int = 10000):
+        self.bot = bot
+        self.limiter = limiter
+        self.delay = delay
+        self.remember = remember
+        self.sent = 0
+        self.skipped = 0
+        # (chat_id, message_id) -> клавиатура, ждущая отправки
+        self._pending = {}
+        self._workers = {}
+        self._flushing = None
+        # Последняя отправленная клавиатура по сообщению (LRU)
+        self._last = OrderedDict()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def schedule(self, chat_id: int, message_id: int, markup: str):
+        key = (chat_id, message_id)
+        self._pending[key] = markup
+        if key not in self._workers:
+            self._workers[key] = asyncio.create_task(self._worker(key))
+
+    def _flush_event(self):
+        # Событие одно на всё время жизни: flush() его взводит и сбрасывает, но не обнуляет
+        if self._flushing is None:
+            self._flushing = asyncio.Event()
+        return self._flushing
+
+    async def _worker(self, key):
+        flushing = self._flush_event()
+        try:
+            while key in self._pending:
+                try:
+                    # Ждём окно дебаунса; flush() будит всех сразу
+                    await asyncio.wait_for(flushing.wait(), self.delay)
+                except asyncio.TimeoutError:
+                    pass
+                await self._send(key, self._pending.pop(key))
+        finally:
+            del self._workers[key]
+
+    async def _send(self, key, markup):
+        if self._last.get(key) == markup:
+            self.skipped += 1
+            return
+        await self.limiter.acquire()
+        try:
+            await self.bot.edit_message_reply_markup(chat_id=key[0], message_id=key[1], reply_markup=markup)
+            self.sent += 1
+        except MessageNotModified:
+            self.skipped += 1
+        except RetryAfter as e:
+            # Притормаживаем все запросы и пробуем ещё раз, если новых голосов не пришло
+            self.limiter.pause(e.timeout)
+            self._pending.setdefault(key, markup)
+            return
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении клавиатуры {key}: {e}")
+            return
+        self._last[key] = markup
+        self._last.move_to_end(key)
+        if len(self._last) > self.remember:
+            self._last.popitem(last=False)
+
+    async def flush(self):
+        # При остановке отправляем всё, что ждёт окна, не дожидаясь таймеров
+        flushing = self._flush_event()
+        flushing.set()
+        # Воркеры, появившиеся во время ожидания, тоже дожидаемся
+        while self._workers:
+            await asyncio.gather(*list(self._workers.values()), return_exceptions=True)
+        flushing.clear()
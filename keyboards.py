@@ -0,0 +1,75 @@
+# Кэш готовых клавиатур. aiogram передаёт строковый reply_markup в Bot API
+# как есть, поэтому клавиатуры хранятся уже сериализованными в JSON:
+# статичные собираются один раз, клавиатуры под контентом живут в LRU
+# по ключу (тип, id, лайки, дизлайки).
+import json
+from collections import OrderedDict
+
+from callbacks import pack_callback
+
+MENU_LAYOUT = [
+    ['🎥 Видео', '🖼️ Мемы'],
+    ['📦 Стикеры', '🎙️ Голосовухи'],
+    ['🍀 Узнать уровень удачи'],
+]
+
+
+def dump_markup(markup: dict) -> str:
+    return json.dumps(markup, ensure_ascii=False, separators=(',', ':'))
+
+
+MENU_KEYBOARD = dump_markup({
+    'keyboard': [[{'text': text} for text in row] for row in MENU_LAYOUT],
+    'resize_keyboard': True,
+})
+
+
+def build_vote_keyboard(content_type: str, uid: int, likes: int, dislikes: int) -> str:
+    return dump_markup({'inline_keyboard': [
+        [
+            {'text': f"👍 {likes}", 'callback_data': pack_callback('like', content_type, uid)},
+            {'text': f"👎 {dislikes}", 'callback_data': pack_callback('dislike', content_type, uid)},
+        ],
+        [{'text': "➡️ Следующее", 'callback_data': pack_callback('next', content_type)}],
+    ]})
+
+
+def build_subscription_keyboard(channels) -> str:
+    rows = [[{'text': channel, 'url': f"https://t.me/{channel.lstrip('@')}"}] for channel in channels]
+    rows.append([{'text': '✅ Проверить подписку', 'callback_data': 'check_subscription'}])
+    return dump_markup({'inline_keyboard': rows})
+
+
+class KeyboardCache:
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._votes = OrderedDict()
+        self._subscription_key = None
+        self._subscription = None
+
+    def __len__(self):
+        return len(self._votes)
+
+    def vote_keyboard(self, content_type: str, uid: int, likes: int, dislikes: int) -> str:
+        key = (content_type, uid, likes, dislikes)
+        markup = self._votes.get(key)
+        if markup is not None:
+            self._votes.move_to_end(key)
+            self.hits += 1
+            return markup
+
+        self.misses += 1
+        markup = self._votes[key] = build_vote_keyboard(content_type, uid, likes, dislikes)
+        if len(self._votes) > self.maxsize:
+            self._votes.popitem(last=False)
+        return markup
+
+    def subscription_keyboard(self, channels) -> str:
+        # Список каналов меняется командами /add_channel и /minus_channel
+        key = tuple(channels)
+        if key != self._subscription_key:
+            self._subscription = build_subscription_keyboard(key)
+            self._subscription_key = key
+        return self._subscription
@@ -0,0 +1,155 @@
+# Жизненный цикл бота: быстрый старт и аккуратная остановка.
+# Старт: схема создаётся/обновляется только если её версия в базе устарела,
+# кэши прогреваются параллельно, время от запуска процесса до готовности и
+# до первого апдейта пишется в лог и в метрики.
+# Остановка: по SIGTERM/SIGINT прекращаем получать апдейты, дожидаемся уже
+# начатых и сбрасываем буферы, укладываясь в общий срок.
+import asyncio
+import logging
+import signal
+from time import perf_counter
+
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+logger = logging.getLogger(__name__)
+
+# Ключ pg_advisory_lock: две копии бота не обновляют схему одновременно
+SCHEMA_LOCK_KEY = 0x6d656d6f
+
+
+class Lifecycle:
+    def __init__(self, started: float = None):
+        self.started = started or perf_counter()
+        self.ready_at = None
+        self.first_update_at = None
+        self.in_flight = 0
+        self._idle = None
+        self._stop = None
+
+    @property
+    def startup_seconds(self) -> float:
+        return self.ready_at - self.started if self.ready_at else 0.0
+
+    @property
+    def first_update_seconds(self) -> float:
+        return self.first_update_at - self.started if self.first_update_at else 0.0
+
+    def install_signal_handlers(self, signals=(signal.SIGTERM, signal.SIGINT)):
+        loop = asyncio.get_running_loop()
+        for sig in signals:
+            try:
+                loop.add_signal_handler(sig, self.request_stop)
+            except (NotImplementedError, AttributeError, RuntimeError):
+                logger.warning(f"Сигнал {sig} недоступен, корректная остановка только по Ctrl+C.")
+
+    def request_stop(self):
+        if self._stop is None:
+            self._stop = asyncio.Event()
+        if not self._stop.is_set():
+            logger.info("Получен сигнал остановки.")
+            self._stop.set()
+
+    async def wait_stop(self):
+        if self._stop is None:
+            self._stop = asyncio.Event()
+        await self._stop.wait()
+
+    def mark_ready(self):
+        self.ready_at = perf_counter()
+        logger.info(f"Бот готов к приёму апдейтов через {self.startup_seconds:.2f} с после запуска.")
+
+    def update_started(self):
+        if self.first_update_at is None:
+            self.first_update_at = perf_counter()
+            logger.info(f"Первый апдейт через {self.first_update_seconds:.2f} с после запуска.")
+        self.in_flight += 1
+        if self._idle is not None:
+            self._idle.clear()
+
+    def update_finished(self):
+        self.in_flight -= 1
+        if self.in_flight == 0 and self._idle is not None:
+            self._idle.set()
+
+    async def wait_idle(self, timeout: float) -> bool:
+        # Ждём, пока допроцессятся апдейты, полученные до остановки
+        if self.in_flight == 0:
+            return True
+        if self._idle is None:
+            self._idle = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._idle.wait(), max(timeout, 0))
+            return True
+        except asyncio.TimeoutError:
+            logger.warning(f"Не дождались {self.in_flight} апдейтов при остановке.")
+            return False
+
+
+class LifecycleMiddleware(BaseMiddleware):
+    def __init__(self, lifecycle: Lifecycle):
+        super().__init__()
+        self.lifecycle = lifecycle
+
+    async def on_pre_process_update(self, update, data: dict):
+        self.lifecycle.update_started()
+
+    async def on_post_process_update(self, update, result, data: dict):
+        self.lifecycle.update_finished()
+
+
+async def ensure_schema(pool, version: int, migrate) -> bool:
+    # migrate() — корутина, создающая/обновляющая таблицы; возвращает True при успехе.
+    # Возвращает True, если схема обновлялась.
+    async with pool.acquire() as conn:
+        exists = await conn.fetchval("SELECT to_regclass('schema_version') IS NOT NULL")
+        current = await conn.fetchval("SELECT version FROM schema_version") if exists else None
+        if current == version:
+            logger.info(f"Схема актуальна (версия {version}), создание таблиц пропущено.")
+            return False
+        await conn.execute("SELECT pg_advisory_lock($1)", SCHEMA_LOCK_KEY)
+        try:
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                    version INTEGER NOT NULL
+                )
+            """)
+            # Пока ждали блокировку, схему могла обновить другая копия
+            if await conn.fetchval("SELECT version FROM schema_version") == version:
+                return False
+            if not await migrate():
+                raise RuntimeError("Не удалось обновить схему базы данных")
+            await conn.execute("""
+                INSERT INTO schema_version (id, version) VALUES (TRUE, $1)
+                ON CONFLICT (id) DO UPDATE SET version = EXCLUDED.version
+            """, version)
+            logger.info(f"Схема обновлена: {current} -> {version}.")
+            return True
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", SCHEMA_LOCK_KEY)
+
+
+async def warm_up(tasks: dict):
+    # Параллельный прогрев: ошибка одного кэша не мешает остальным и старту
+    async def timed(name, coro):
+        start = perf_counter()
+        try:
+            await coro
+        except Exception as e:
+            logger.error(f"Ошибка прогрева {name}: {e}")
+            return f"{name} ошибка"
+        return f"{name} {(perf_counter() - start) * 1000:.0f} мс"
+
+    start = perf_counter()
+    results = await asyncio.gather(*(timed(name, coro) for name, coro in tasks.items()))
+    logger.info(f"Прогрев за {(perf_counter() - start) * 1000:.0f} мс: {', '.join(results)}")
+
+
+async def run_with_deadline(name: str, coro, deadline: float):
+    # Шаг остановки, которому достаётся остаток общего срока
+    try:
+        await asyncio.wait_for(coro, max(deadline - perf_counter(), 0))
+    except asyncio.TimeoutError:
+        logger.warning(f"Остановка: {name} не успел завершиться.")
+    except Exception as e:
+        logger.error(f"Остановка: ошибка в {name}: {e}")
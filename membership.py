@@ -0,0 +1,125 @@
+# Кэш подписок на обязательные каналы.
+# Бот — админ в каналах и получает апдейты chat_member, поэтому вступления и
+# выходы приходят сами: проверка подписки — это поиск в словаре. get_chat_member
+# остаётся для пользователей, о которых ещё ничего не известно (например, после
+# перезапуска), и для фоновой сверки старых записей — на случай пропущенных
+# апдейтов, пока бот был выключен.
+import asyncio
+import logging
+from collections import OrderedDict
+from time import monotonic
+
+from ratelimit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+MEMBER_STATUSES = ("member", "administrator", "creator")
+
+
+class MembershipCache:
+    def __init__(self, bot, max_age: float = 21600.0, check_rate: float = 5.0, max_users: int = 200000):
+        self.bot = bot
+        self.max_age = max_age
+        self.max_users = max_users
+        self.limiter = RateLimiter(check_rate)
+        self.hits = 0
+        self.misses = 0
+        self.events = 0
+        # канал (как в PUBLIC_CHANNELS) -> OrderedDict user_id -> (подписан, когда проверено);
+        # порядок — по времени последнего обновления, в голове самые старые
+        self._members = {}
+        # chat.id -> канал: в chat_member приходит числовой id, а в списке — @username
+        self._chat_ids = {}
+        # (канал, user_id) -> идущий get_chat_member: параллельные промахи по одному
+        # пользователю (пачка нажатий сразу после старта) ждут один запрос
+        self._pending = {}
+
+    def __len__(self):
+        return sum(len(users) for users in self._members.values())
+
+    async def resolve(self, channels):
+        for channel in channels:
+            try:
+                chat = await self.bot.get_chat(channel)
+                self._chat_ids[chat.id] = channel
+            except Exception as e:
+                logger.error(f"Не удалось получить канал {channel}: {e}")
+
+    def forget(self, channel: str):
+        self._members.pop(channel, None)
+        for chat_id in [chat_id for chat_id, name in self._chat_ids.items() if name == channel]:
+            del self._chat_ids[chat_id]
+
+    def _store(self, channel: str, user_id: int, subscribed: bool):
+        users = self._members.setdefault(channel, OrderedDict())
+        users.pop(user_id, None)
+        users[user_id] = (subscribed, monotonic())
+        if len(users) > self.max_users:
+            users.popitem(last=False)
+
+    def on_chat_member(self, update):
+        channel = self._chat_ids.get(update.chat.id)
+        if channel is None:
+            return False
+        self.events += 1
+        self._store(channel, update.new_chat_member.user.id, update.new_chat_member.status in MEMBER_STATUSES)
+        return True
+
+    async def check(self, channel: str, user_id: int) -> bool:
+        member = await self.bot.get_chat_member(chat_id=channel, user_id=user_id)
+        subscribed = member.status in MEMBER_STATUSES
+        self._store(channel, user_id, subscribed)
+        return subscribed
+
+    async def is_member(self, channel: str, user_id: int, fresh: bool = False) -> bool:
+        cached = self._members.get(channel, {}).get(user_id)
+        if cached is not None and not fresh and monotonic() - cached[1] < self.max_age:
+            self.hits += 1
+            return cached[0]
+        self.misses += 1
+        key = (channel, user_id)
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = asyncio.ensure_future(self.check(channel, user_id))
+            pending.add_done_callback(lambda _: self._pending.pop(key, None))
+        return await asyncio.shield(pending)
+
+    async def reconcile(self, channel: str, batch: int = 100) -> int:
+        # Перепроверяем самые старые записи, пока они не истекли и не ушли в синхронный запрос
+        users = self._members.get(channel)
+        if not users:
+            return 0
+        horizon = monotonic() - self.max_age / 2
+        stale = []
+        for user_id, (_, checked) in users.items():
+            if checked >= horizon or len(stale) >= batch:
+                break
+            stale.append(user_id)
+        # Возвращаем число успешных проверок: после ошибки run уходит в паузу, а не крутит цикл
+        checked = 0
+        for user_id in stale:
+            await self.limiter.acquire()
+            try:
+                await self.check(channel, user_id)
+            except Exception as e:
+                logger.error(f"Ошибка сверки подписки {user_id} на {channel}: {e}")
+                break
+            checked += 1
+        return checked
+
+    async def run(self, channels, interval: float = 60.0):
+        # channels — тот же список, что меняют /add_channel и /minus_channel
+        while True:
+            try:
+                checked = 0
+                for channel in list(channels):
+                    if channel not in self._chat_ids.values():
+                        await self.resolve([channel])
+                    checked += await self.reconcile(channel)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка при сверке подписок: {e}")
+                checked = 0
+            if not checked:
+                await asyncio.sleep(interval)
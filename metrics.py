@@ -0,0 +1,236 @@
+# Метрики бота в текстовом формате Prometheus.
+# Всё хранится в обычных списках и словарях внутри процесса: наблюдение —
+# это bisect по фиксированным бакетам и пара инкрементов, без блокировок
+# (весь бот живёт в одном event loop).
+import logging
+from bisect import bisect_left
+from contextvars import ContextVar
+from time import perf_counter
+
+import asyncpg
+from aiohttp import web
+from aiogram import Bot
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Имя хендлера, который сейчас обрабатывает апдейт (для подсчёта ошибок в логах)
+current_handler_name = ContextVar('current_handler_name', default='-')
+# Накопитель времени в БД для текущего апдейта: [секунды] или None вне апдейта
+current_db_time = ContextVar('current_db_time', default=None)
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    def __init__(self):
+        self.update_latency = Histogram()
+        self.db_time = Histogram()
+        self.handler_latency = {}
+        self.handler_errors = {}
+        self.api_latency = {}
+        self.api_errors = {}
+        self.updates_total = 0
+        self.updates_in_flight = 0
+        # Дополнительные метрики: имя -> функция без аргументов
+        self.gauges = {}
+        # То же для монотонно растущих значений (рисуются как counter)
+        self.counters = {}
+
+    def observe_handler(self, name, value):
+        hist = self.handler_latency.get(name)
+        if hist is None:
+            hist = self.handler_latency[name] = Histogram()
+        hist.observe(value)
+
+    def observe_api(self, method, value):
+        hist = self.api_latency.get(method)
+        if hist is None:
+            hist = self.api_latency[method] = Histogram()
+        hist.observe(value)
+
+    def count_handler_error(self, name):
+        self.handler_errors[name] = self.handler_errors.get(name, 0) + 1
+
+    def count_api_error(self, method):
+        self.api_errors[method] = self.api_errors.get(method, 0) + 1
+
+    def render(self) -> str:
+        lines = []
+        _render_histogram(lines, 'bot_update_latency_seconds', {'': self.update_latency})
+        _render_histogram(lines, 'bot_update_db_seconds', {'': self.db_time})
+        _render_histogram(lines, 'bot_handler_latency_seconds', self.handler_latency, 'handler')
+        _render_histogram(lines, 'bot_telegram_api_latency_seconds', self.api_latency, 'method')
+        _render_counter(lines, 'bot_handler_errors_total', self.handler_errors, 'handler')
+        _render_counter(lines, 'bot_telegram_api_errors_total', self.api_errors, 'method')
+        lines.append('# TYPE bot_updates_total counter')
+        lines.append(f'bot_updates_total {self.updates_total}')
+        lines.append('# TYPE bot_updates_in_flight gauge')
+        lines.append(f'bot_updates_in_flight {self.updates_in_flight}')
+        for kind, funcs in (('gauge', self.gauges), ('counter', self.counters)):
+            for name, func in funcs.items():
+                try:
+                    value = func()
+                except Exception as e:
+                    logger.error(f"Ошибка при расчёте метрики {name}: {e}")
+                    continue
+                lines.append(f'# TYPE {name} {kind}')
+                lines.append(f'{name} {value}')
+        lines.append('')
+        return '\n'.join(lines)
+
+
+def _render_histogram(lines, name, hists, label=None):
+    lines.append(f'# TYPE {name} histogram')
+    for key, hist in hists.items():
+        prefix = f'{label}="{key}",' if label else ''
+        cumulative = 0
+        for bound, count in zip(hist.buckets, hist.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {hist.count}')
+        labels = f'{{{label}="{key}"}}' if label else ''
+        lines.append(f'{name}_sum{labels} {hist.sum}')
+        lines.append(f'{name}_count{labels} {hist.count}')
+
+
+def _render_counter(lines, name, values, label):
+    lines.append(f'# TYPE {name} counter')
+    for key, value in values.items():
+        lines.append(f'{name}{{{label}="{key}"}} {value}')
+
+
+metrics = Metrics()
+
+
+class MetricsMiddleware(BaseMiddleware):
+    def __init__(self, registry: Metrics = metrics):
+        super().__init__()
+        self.registry = registry
+
+    async def on_pre_process_update(self, update, data):
+        self.registry.updates_in_flight += 1
+        data['_metrics_start'] = perf_counter()
+        data['_metrics_db'] = db_time = [0.0]
+        current_db_time.set(db_time)
+
+    async def on_post_process_update(self, update, results, data):
+        registry = self.registry
+        registry.updates_in_flight -= 1
+        registry.updates_total += 1
+        registry.update_latency.observe(perf_counter() - data['_metrics_start'])
+        registry.db_time.observe(data['_metrics_db'][0])
+
+    def _start_handler(self, data):
+        name = current_handler.get().__name__
+        current_handler_name.set(name)
+        data['_metrics_handler'] = name
+        data['_metrics_handler_start'] = perf_counter()
+
+    def _finish_handler(self, data):
+        if '_metrics_handler' in data:
+            # Имя берём из контекста: роутер мог уточнить конечный хендлер
+            self.registry.observe_handler(current_handler_name.get(),
+                                          perf_counter() - data['_metrics_handler_start'])
+
+    async def on_process_message(self, message, data):
+        self._start_handler(data)
+
+    async def on_post_process_message(self, message, results, data):
+        self._finish_handler(data)
+
+    async def on_process_callback_query(self, callback_query, data):
+        self._start_handler(data)
+
+    async def on_post_process_callback_query(self, callback_query, results, data):
+        self._finish_handler(data)
+
+    async def on_pre_process_error(self, update, error, data):
+        # Исключение, которое хендлер не поймал сам
+        self.registry.count_handler_error(current_handler_name.get())
+
+
+def label_handler(handler):
+    # Для хендлеров-роутеров: метрики и ошибки пишутся на конечный хендлер
+    current_handler_name.set(handler.__name__)
+
+
+class ErrorCountingHandler(logging.Handler):
+    # Хендлеры ловят свои исключения сами и пишут logger.error, поэтому ошибки
+    # считаем по записям уровня ERROR. Вешается на логгер бота, а не на корневой:
+    # ошибки aiogram/asyncpg/aiocron не относятся к хендлеру из контекста.
+    def __init__(self, registry: Metrics = metrics):
+        super().__init__(level=logging.ERROR)
+        self.registry = registry
+
+    def emit(self, record):
+        self.registry.count_handler_error(current_handler_name.get())
+
+
+class TimedBot(Bot):
+    async def request(self, method, data=None, files=None, **kwargs):
+        start = perf_counter()
+        try:
+            return await super().request(method, data, files, **kwargs)
+        except Exception:
+            metrics.count_api_error(method)
+            raise
+        finally:
+            metrics.observe_api(method, perf_counter() - start)
+
+
+def _timed_query(name):
+    method = getattr(asyncpg.Connection, name)
+
+    async def wrapper(self, *args, **kwargs):
+        start = perf_counter()
+        try:
+            return await method(self, *args, **kwargs)
+        finally:
+            db_time = current_db_time.get()
+            if db_time is not None:
+                db_time[0] += perf_counter() - start
+
+    wrapper.__name__ = name
+    wrapper.__qualname__ = f'TimedConnection.{name}'
+    return wrapper
+
+
+class TimedConnection(asyncpg.Connection):
+    execute = _timed_query('execute')
+    executemany = _timed_query('executemany')
+    fetch = _timed_query('fetch')
+    fetchrow = _timed_query('fetchrow')
+    fetchval = _timed_query('fetchval')
+
+
+async def start_metrics_server(host, port, registry: Metrics = metrics):
+    async def handle_metrics(request):
+        return web.Response(
+            body=registry.render().encode(),
+            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+        )
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,149 @@
+# Профилирование по запросу и трассировка медленных апдейтов.
+# SamplingProfiler периодически снимает стек главного потока и копит их
+# в формате collapsed stacks (flamegraph.pl / speedscope / inferno).
+# span() отмечает участки обработки апдейта; TracingMiddleware пишет в лог
+# разбивку по участкам для апдейтов дольше порога, traced() — то же для работы,
+# вынесенной из апдейта в фоновую задачу.
+import logging
+import os
+import sys
+import threading
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+from time import perf_counter
+
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+logger = logging.getLogger(__name__)
+
+current_trace = ContextVar('current_trace', default=None)
+
+
+class Trace:
+    __slots__ = ('spans',)
+
+    def __init__(self):
+        self.spans = []
+
+    def breakdown(self) -> str:
+        return ', '.join(f"{name}={duration * 1000:.1f}ms" for name, duration in self.spans)
+
+
+class span:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        trace = current_trace.get()
+        if trace is not None:
+            trace.spans.append((self.name, perf_counter() - self.start))
+        return False
+
+
+class TracingMiddleware(BaseMiddleware):
+    def __init__(self, threshold: float):
+        super().__init__()
+        self.threshold = threshold
+
+    async def on_pre_process_update(self, update, data):
+        trace = Trace()
+        current_trace.set(trace)
+        data['_trace'] = trace
+        data['_trace_start'] = perf_counter()
+
+    async def on_post_process_update(self, update, results, data):
+        elapsed = perf_counter() - data['_trace_start']
+        if elapsed >= self.threshold:
+            logger.warning(f"Медленный апдейт {update.update_id}: {elapsed * 1000:.1f}ms "
+                           f"[{data['_trace'].breakdown() or 'нет участков'}]")
+
+
+async def traced(coro, name: str, threshold: float, queued: float = None):
+    # Фоновая задача доживает до конца уже после post_process_update, поэтому
+    # у неё свой Trace и своя проверка порога; queued — когда задачу поставили
+    # в очередь, ожидание свободного слота попадает в разбивку как queue
+    trace = Trace()
+    current_trace.set(trace)
+    start = perf_counter()
+    if queued is not None:
+        trace.spans.append(('queue', start - queued))
+    else:
+        queued = start
+    try:
+        return await coro
+    finally:
+        elapsed = perf_counter() - queued
+        if elapsed >= threshold:
+            logger.warning(f"Медленная фоновая задача {name}: {elapsed * 1000:.1f}ms "
+                           f"[{trace.breakdown() or 'нет участков'}]")
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self.started_at = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._target = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, thread_id: int = None):
+        if self.running:
+            return
+        self._target = thread_id or threading.main_thread().ident
+        self.stacks = Counter()
+        self.started_at = datetime.now()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        logger.info(f"Профилировщик запущен (интервал {self.interval * 1000:.1f}ms).")
+
+    def stop(self) -> Counter:
+        if not self.running:
+            return self.stacks
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        logger.info(f"Профилировщик остановлен, снято {sum(self.stacks.values())} сэмплов.")
+        return self.stacks
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is None or self._target == own:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            names.reverse()
+            self.stacks[';'.join(names)] += 1
+
+    def dump(self, directory: str) -> str:
+        stamp = (self.started_at or datetime.now()).strftime('%Y%m%d-%H%M%S')
+        path = os.path.join(directory, f"profile-{stamp}.folded")
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+    def toggle(self, directory: str):
+        # Возвращает путь к дампу, если профилировщик был остановлен
+        if self.running:
+            self.stop()
+            return self.dump(directory)
+        self.start()
+        return None
@@ -0,0 +1,173 @@
+# Выбор контента с учётом популярности.
+# Каждой единице контента считается вес: нижняя граница Вильсона по
+# лайкам/дизлайкам, умноженная на затухание по возрасту. Веса лежат в памяти
+# в виде alias-таблицы (метод Воуза), так что взвешенный выбор — O(1) без
+# ORDER BY по всему каталогу. Фоновая задача пересобирает таблицы для типов,
+# по которым были голоса, и периодически сверяет каталог с базой.
+import asyncio
+import logging
+import math
+import random
+from datetime import datetime
+from time import monotonic
+
+logger = logging.getLogger(__name__)
+
+# Минимальный вес: даже непопулярный контент иногда попадается
+MIN_WEIGHT = 0.01
+# Контент без created_at (добавлен до появления колонки) считаем старым:
+# столько периодов полураспада назад — ниже свежего, но порядок по оценкам сохраняется
+UNKNOWN_AGE_HALF_LIVES = 4
+
+
+def wilson_lower_bound(likes: int, dislikes: int, z: float = 1.96) -> float:
+    n = likes + dislikes
+    if n == 0:
+        return 0.0
+    p = likes / n
+    return (p + z * z / (2 * n) - z * math.sqrt((p * (1 - p) + z * z / (4 * n)) / n)) / (1 + z * z / n)
+
+
+class AliasTable:
+    __slots__ = ('prob', 'alias')
+
+    def __init__(self, weights):
+        n = len(weights)
+        total = sum(weights)
+        scaled = [w * n / total for w in weights]
+        self.prob = [1.0] * n
+        self.alias = list(range(n))
+        small = [i for i, w in enumerate(scaled) if w < 1.0]
+        large = [i for i, w in enumerate(scaled) if w >= 1.0]
+        while small and large:
+            s = small.pop()
+            g = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = g
+            scaled[g] -= 1.0 - scaled[s]
+            (small if scaled[g] < 1.0 else large).append(g)
+
+    def __len__(self):
+        return len(self.prob)
+
+    def sample(self, rnd=random.random) -> int:
+        r = rnd() * len(self.prob)
+        i = int(r)
+        return i if r - i < self.prob[i] else self.alias[i]
+
+
+class ContentRanking:
+    def __init__(self, tables: dict, half_life_days: float = 14.0, candidates: int = 8):
+        self.tables = tables
+        self.half_life = half_life_days * 86400
+        self.candidates = candidates
+        # content_type -> {uid: [content_id, created_at (unix), likes, dislikes]}
+        self._items = {content_type: {} for content_type in tables}
+        # content_type -> (uids, content_ids, AliasTable)
+        self._samplers = {}
+        self._dirty = set()
+        self._stale = set(tables)
+
+    def weight(self, created_at: float, likes: int, dislikes: int, now: float) -> float:
+        # Псевдоголоса (+1/+1), чтобы новый контент без оценок не получал ноль
+        score = wilson_lower_bound(likes + 1, dislikes + 1)
+        freshness = 0.5 ** (max(0.0, now - created_at) / self.half_life)
+        return max(score * freshness, MIN_WEIGHT)
+
+    def record_vote(self, content_type: str, uid: int, likes: int, dislikes: int):
+        item = self._items.get(content_type, {}).get(uid)
+        if item is not None:
+            item[2] = likes
+            item[3] = dislikes
+            self._dirty.add(content_type)
+
+    def invalidate(self, content_type: str):
+        # Каталог изменился (добавление/удаление) — перечитать из базы
+        self._stale.add(content_type)
+
+    async def load(self, conn, content_type: str):
+        table_name = self.tables[content_type]
+        rows = await conn.fetch(f"""
+            SELECT v.id, v.{content_type}_id AS content_id, v.created_at,
+                   COALESCE(f.likes, 0) AS likes, COALESCE(f.dislikes, 0) AS dislikes
+            FROM {table_name} v
+            LEFT JOIN content_feedback f
+            ON f.content_id = v.{content_type}_id AND f.content_type = $1
+            WHERE v.dead_at IS NULL
+        """, content_type)
+        unknown = datetime.now().timestamp() - UNKNOWN_AGE_HALF_LIVES * self.half_life
+        self._items[content_type] = {
+            row['id']: [row['content_id'], row['created_at'].timestamp() if row['created_at'] else unknown,
+                        row['likes'], row['dislikes']]
+            for row in rows
+        }
+        self._dirty.add(content_type)
+
+    def build(self, snapshot):
+        if not snapshot:
+            return None
+        now = datetime.now().timestamp()
+        uids = [uid for uid, _ in snapshot]
+        content_ids = [item[0] for _, item in snapshot]
+        weights = [self.weight(item[1], item[2], item[3], now) for _, item in snapshot]
+        return uids, content_ids, AliasTable(weights)
+
+    async def rebuild(self, content_type: str):
+        # Снимок берём в цикле событий, а саму сборку уносим в поток
+        snapshot = [(uid, tuple(item)) for uid, item in self._items[content_type].items()]
+        sampler = await asyncio.get_running_loop().run_in_executor(None, self.build, snapshot)
+        if sampler is None:
+            self._samplers.pop(content_type, None)
+        else:
+            self._samplers[content_type] = sampler
+
+    async def warm(self, pool):
+        # Первая загрузка всех типов параллельно, до начала приёма апдейтов
+        async def load_one(content_type):
+            async with pool.acquire() as conn:
+                await self.load(conn, content_type)
+            await self.rebuild(content_type)
+            self._stale.discard(content_type)
+            self._dirty.discard(content_type)
+
+        await asyncio.gather(*(load_one(content_type) for content_type in self.tables))
+
+    async def pick_unseen(self, conn, content_type: str, user_id: int, source: str):
+        sampler = self._samplers.get(content_type)
+        if sampler is None:
+            return None
+        uids, content_ids, alias = sampler
+        picks = list(dict.fromkeys(alias.sample() for _ in range(self.candidates)))
+        seen = await conn.fetch("""
+            SELECT content_id FROM user_content_seen
+            WHERE user_id = $1 AND content_type = $2 AND source = $3 AND content_id = ANY($4::TEXT[])
+        """, user_id, content_type, source, [content_ids[i] for i in picks])
+        seen = {row['content_id'] for row in seen}
+        for i in picks:
+            if content_ids[i] not in seen:
+                return {'id': uids[i], f"{content_type}_id": content_ids[i]}
+        return None
+
+    async def run(self, pool, interval: float = 30.0, resync_interval: float = 600.0):
+        last_resync = monotonic()
+        while True:
+            try:
+                if monotonic() - last_resync >= resync_interval:
+                    self._stale.update(self.tables)
+                    last_resync = monotonic()
+                for content_type in list(self._stale):
+                    self._stale.discard(content_type)
+                    try:
+                        async with pool.acquire() as conn:
+                            await self.load(conn, content_type)
+                    except Exception:
+                        self._stale.add(content_type)
+                        raise
+                for content_type in list(self._dirty):
+                    self._dirty.discard(content_type)
+                    await self.rebuild(content_type)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка при пересборке рейтинга контента: {e}")
+            await asyncio.sleep(interval)
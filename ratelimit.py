@@ -0,0 +1,35 @@
+# Общий ограничитель запросов к Bot API (token bucket).
+# Telegram режет ботов примерно на 30 сообщений в секунду; массовые отправки
+# и правки клавиатур берут токен перед запросом, а после 429 (RetryAfter)
+# ограничитель ставится на паузу для всех сразу.
+import asyncio
+from time import monotonic
+
+
+class RateLimiter:
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        # Меньше одного токена в ведре не бывает: иначе при rate < 1 acquire ждёт вечно
+        self.capacity = max(1.0, burst or rate)
+        self._tokens = self.capacity
+        self._updated = monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        while True:
+            now = monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, monotonic() + seconds)
@@ -0,0 +1,217 @@
+# Рекомендации на основе коллаборативной фильтрации (item-item).
+# Пакетная задача: читает user_feedback, строит разреженную матрицу
+# пользователь × контент (лайк = 1, дизлайк = -1), считает косинусную
+# близость между единицами контента (хранятся только top-N соседей) и пишет
+# top-K кандидатов на пользователя в user_recommendations. send_content
+# берёт оттуда первого непросмотренного одним индексным запросом.
+#
+# Память ограничена бюджетом: близости и оценки считаются разреженными
+# произведениями по блокам строк, размер блока выбирается по верхней оценке
+# числа ненулевых элементов, плотные матрицы n × items не строятся вовсе.
+# NumPy/SciPy импортируются только внутри задачи — боту без них они не нужны.
+#
+#   python recommend.py --top-k 20 --neighbors 50 --memory-mb 512
+import argparse
+import asyncio
+import logging
+import os
+from array import array
+from time import perf_counter
+
+from content_types import CONTENT_TABLES
+
+logger = logging.getLogger(__name__)
+
+RECOMMENDATION_COLUMNS = ['user_id', 'content_type', 'rank', 'content_uid', 'content_id', 'score']
+# Оценка байт на ненулевой элемент промежуточных матриц: данные и индексы
+# произведения, сортировка, маски и их копии. По ней режутся блоки строк.
+BYTES_PER_ENTRY = 64
+
+
+def row_blocks(bounds, capacity: int):
+    # Нарезает строки на блоки так, чтобы сумма оценок nnz в блоке не превышала capacity
+    import numpy as np
+
+    cum = np.cumsum(bounds, dtype=np.int64)
+    start, n = 0, len(cum)
+    while start < n:
+        base = cum[start - 1] if start else 0
+        stop = max(int(np.searchsorted(cum, base + capacity, side='right')), start + 1)
+        yield start, min(stop, n)
+        start = stop
+
+
+def top_per_row(M, k: int, exclude=None):
+    # Top-k положительных значений в каждой строке разреженной M без перевода в плотный вид.
+    # exclude(rows, cols) -> маска элементов, которые нужно отбросить.
+    # Возвращает (rows, cols, vals, rank), отсортированные по строке и убыванию значения.
+    import numpy as np
+
+    rows = np.repeat(np.arange(M.shape[0], dtype=np.int32), np.diff(M.indptr))
+    cols, vals = M.indices, M.data
+    keep = vals > 0
+    if exclude is not None:
+        keep &= ~exclude(rows, cols)
+    rows, cols, vals = rows[keep], cols[keep], vals[keep]
+    order = np.lexsort((-vals, rows))
+    rows, cols, vals = rows[order], cols[order], vals[order]
+    counts = np.bincount(rows, minlength=M.shape[0])
+    rank = np.arange(len(rows), dtype=np.int64) - (np.cumsum(counts) - counts)[rows]
+    sel = rank < k
+    return rows[sel], cols[sel], vals[sel], rank[sel].astype(np.int16)
+
+
+def item_neighbors(R, neighbors: int, budget_bytes: int):
+    # Разреженная матрица S: в строке j — top-N самых похожих на j единиц контента
+    import numpy as np
+    from scipy import sparse
+
+    n_items = R.shape[1]
+    n = min(neighbors, n_items - 1)
+    if n <= 0:
+        return sparse.csr_matrix((n_items, n_items), dtype=np.float32)
+
+    norms = np.sqrt(np.asarray(R.multiply(R).sum(axis=0)).ravel())
+    norms[norms == 0] = 1.0
+    Rn = (R @ sparse.diags((1.0 / norms).astype(np.float32))).tocsr()
+    RnT = Rn.T.tocsr()
+    # Верхняя оценка числа соседей item j: сумма длин профилей всех, кто за него голосовал
+    voters = (R != 0).astype(np.int64)
+    bounds = np.minimum(n_items, voters.T @ np.diff(R.indptr).astype(np.int64))
+
+    rows, cols, vals = [], [], []
+    for start, stop in row_blocks(bounds, budget_bytes // BYTES_PER_ENTRY):
+        block_rows, block_cols, block_vals, _ = top_per_row(
+            RnT[start:stop] @ Rn, n, exclude=lambda r, c: r + start == c)
+        rows.append(block_rows + start)
+        cols.append(block_cols)
+        vals.append(block_vals)
+    return sparse.csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+                             shape=(n_items, n_items))
+
+
+def compute_recommendations(user_idx, item_idx, values, n_users: int, n_items: int,
+                            top_k: int = 20, neighbors: int = 50, memory_mb: int = 256):
+    # Возвращает массивы (user_index, item_index, score, rank)
+    import numpy as np
+    from scipy import sparse
+
+    budget = memory_mb * 1024 * 1024
+    R = sparse.csr_matrix((np.asarray(values, dtype=np.float32),
+                           (np.asarray(user_idx, dtype=np.int32), np.asarray(item_idx, dtype=np.int32))),
+                          shape=(n_users, n_items))
+    R.sum_duplicates()
+    S = item_neighbors(R, neighbors, budget)
+    liked = (R > 0).astype(np.float32).tocsr()
+    bounds = np.minimum(n_items, liked.astype(np.int64) @ np.diff(S.indptr).astype(np.int64))
+
+    out_users, out_items, out_scores, out_ranks = [], [], [], []
+    for start, stop in row_blocks(bounds, budget // BYTES_PER_ENTRY):
+        voted = R[start:stop].tocoo()
+        voted_keys = voted.row.astype(np.int64) * n_items + voted.col
+
+        def already_voted(rows, cols):
+            # Не рекомендуем то, за что пользователь уже голосовал
+            return np.isin(rows.astype(np.int64) * n_items + cols, voted_keys)
+
+        rows, cols, vals, rank = top_per_row(liked[start:stop] @ S, top_k, exclude=already_voted)
+        out_users.append(rows + start)
+        out_items.append(cols)
+        out_scores.append(vals)
+        out_ranks.append(rank)
+    if not out_users:
+        empty = np.empty(0, dtype=np.int32)
+        return empty, empty, np.empty(0, dtype=np.float32), empty
+    return (np.concatenate(out_users), np.concatenate(out_items),
+            np.concatenate(out_scores), np.concatenate(out_ranks))
+
+
+async def load_feedback(conn, content_type: str, catalog: dict, prefetch: int = 50000):
+    # Потоково читает голоса в компактные массивы; голоса за удалённый контент пропускаются
+    users, items = {}, {}
+    user_idx, item_idx, values = array('i'), array('i'), array('b')
+    async with conn.transaction():
+        async for row in conn.cursor("""
+            SELECT user_id, content_id, feedback_type FROM user_feedback WHERE content_type = $1
+        """, content_type, prefetch=prefetch):
+            if row['content_id'] not in catalog:
+                continue
+            user_idx.append(users.setdefault(row['user_id'], len(users)))
+            item_idx.append(items.setdefault(row['content_id'], len(items)))
+            values.append(1 if row['feedback_type'] == 'like' else -1)
+    return list(users), list(items), user_idx, item_idx, values
+
+
+async def run_batch(pool, tables: dict = CONTENT_TABLES, top_k: int = 20, neighbors: int = 50,
+                    memory_mb: int = 256):
+    started = perf_counter()
+    loop = asyncio.get_running_loop()
+    total = 0
+    async with pool.acquire() as conn:
+        await conn.execute("""
+            DROP TABLE IF EXISTS user_recommendations_new;
+            CREATE TABLE user_recommendations_new (LIKE user_recommendations INCLUDING ALL);
+        """)
+        for content_type, table_name in tables.items():
+            catalog = {row[1]: row[0] for row in await conn.fetch(
+                f"SELECT id, {content_type}_id FROM {table_name} WHERE dead_at IS NULL")}
+            users, items, user_idx, item_idx, values = await load_feedback(conn, content_type, catalog)
+            if not values:
+                continue
+            # Счёт в потоке, чтобы не блокировать цикл событий бота
+            rec_users, rec_items, rec_scores, rec_ranks = await loop.run_in_executor(
+                None, compute_recommendations, user_idx, item_idx, values, len(users), len(items),
+                top_k, neighbors, memory_mb)
+            records = (
+                (users[u], content_type, int(rank), catalog[items[i]], items[i], float(score))
+                for u, i, score, rank in zip(rec_users.tolist(), rec_items.tolist(),
+                                             rec_scores.tolist(), rec_ranks.tolist())
+            )
+            await conn.copy_records_to_table('user_recommendations_new', records=records,
+                                             columns=RECOMMENDATION_COLUMNS)
+            total += len(rec_users)
+            logger.info(f"Рекомендации для {content_type}: {len(users)} пользователей, "
+                        f"{len(items)} единиц контента, {len(values)} голосов.")
+        async with conn.transaction():
+            await conn.execute("""
+                DROP TABLE user_recommendations;
+                ALTER TABLE user_recommendations_new RENAME TO user_recommendations;
+                ALTER INDEX user_recommendations_new_pkey RENAME TO user_recommendations_pkey;
+            """)
+    logger.info(f"Рекомендации пересчитаны: {total} строк за {perf_counter() - started:.1f}s.")
+    return total
+
+
+async def pick_recommended(conn, content_type: str, user_id: int, source: str):
+    return await conn.fetchrow(f"""
+        SELECT r.content_uid AS id, r.content_id AS {content_type}_id FROM user_recommendations r
+        JOIN {CONTENT_TABLES[content_type]} v ON v.id = r.content_uid AND v.dead_at IS NULL
+        WHERE r.user_id = $1 AND r.content_type = $2
+        AND NOT EXISTS (
+            SELECT 1 FROM user_content_seen uc
+            WHERE uc.user_id = $1 AND uc.content_id = r.content_id
+            AND uc.content_type = $2 AND uc.source = $3
+        )
+        ORDER BY r.rank LIMIT 1
+    """, user_id, content_type, source)
+
+
+async def main(args):
+    import asyncpg
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    pool = await asyncpg.create_pool(os.getenv("DATABASE_URL"))
+    try:
+        await run_batch(pool, top_k=args.top_k, neighbors=args.neighbors, memory_mb=args.memory_mb)
+    finally:
+        await pool.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Rebuild user_recommendations from user_feedback.")
+    parser.add_argument('--top-k', type=int, default=20)
+    parser.add_argument('--neighbors', type=int, default=50)
+    parser.add_argument('--memory-mb', type=int, default=256)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,166 @@
+# Хранение истории просмотров.
+# user_content — журнал просмотров, секционированный по месяцам на created_at:
+# дневной лимит читает только секцию текущего месяца, индексы каждой секции
+# маленькие, а старые месяцы удаляются целиком через DETACH + DROP вместо
+# DELETE и долгого VACUUM. Факт «пользователь уже видел» вынесен в компактную
+# user_content_seen (одна строка на пользователя и единицу контента), по ней
+# идут анти-джойны. Перед удалением секция сворачивается в дневные агрегаты
+# user_content_daily, чтобы не терять статистику.
+#
+# user_feedback не секционируется: его первичный ключ обеспечивает «один голос
+# на контент» за всё время, а у секционированной таблицы ключ обязан включать
+# ключ секционирования. Он и так растёт не быстрее user_content_seen.
+import logging
+import re
+from datetime import date, datetime
+
+logger = logging.getLogger(__name__)
+
+PARENT = 'user_content'
+DEFAULT_PARTITION = 'user_content_default'
+LEGACY_PARTITION = 'user_content_legacy'
+
+_BOUND = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+
+def month_start(day, shift: int = 0) -> date:
+    month = day.year * 12 + day.month - 1 + shift
+    return date(month // 12, month % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{PARENT}_p{month:%Y_%m}"
+
+
+def _parse_bound(value: str):
+    value = value.strip("'")
+    if value == 'MINVALUE':
+        return date.min
+    if value == 'MAXVALUE':
+        return date.max
+    return datetime.fromisoformat(value).date()
+
+
+async def list_partitions(conn):
+    # [(имя, нижняя граница, верхняя граница)]; секция по умолчанию не входит
+    rows = await conn.fetch("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) AS bound
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = $1::regclass
+    """, PARENT)
+    partitions = []
+    for row in rows:
+        match = _BOUND.search(row['bound'])
+        if match:
+            partitions.append((row['relname'], _parse_bound(match.group(1)), _parse_bound(match.group(2))))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+async def migrate_legacy(conn):
+    # Старая несекционированная user_content становится одной секцией
+    # «всё до следующего месяца»: данные не копируются, только проверяются.
+    relkind = await conn.fetchval("SELECT relkind::TEXT FROM pg_class WHERE oid = to_regclass($1)", PARENT)
+    if relkind != 'r':
+        return False
+    upper = month_start(date.today(), 1)
+    async with conn.transaction():
+        await conn.execute(f"""
+            ALTER TABLE {PARENT} RENAME TO {LEGACY_PARTITION};
+            UPDATE {LEGACY_PARTITION} SET created_at = NOW() WHERE created_at IS NULL;
+            ALTER TABLE {LEGACY_PARTITION} ALTER COLUMN created_at SET NOT NULL;
+            CREATE TABLE {PARENT} (LIKE {LEGACY_PARTITION} INCLUDING DEFAULTS)
+                PARTITION BY RANGE (created_at);
+            INSERT INTO user_content_seen (user_id, content_type, source, content_id)
+                SELECT DISTINCT user_id, content_type, source, content_id FROM {LEGACY_PARTITION}
+                ON CONFLICT DO NOTHING;
+            ALTER TABLE {PARENT} ATTACH PARTITION {LEGACY_PARTITION}
+                FOR VALUES FROM (MINVALUE) TO ('{upper}');
+        """)
+    logger.info(f"user_content переведена на секционирование, старые данные — в {LEGACY_PARTITION}.")
+    return True
+
+
+async def ensure_partitions(conn, months_ahead: int = 2):
+    # Секции на текущий месяц и months_ahead вперёд, а также на месяцы, строки
+    # которых уже осели в секции по умолчанию; занятые диапазоны пропускаются
+    existing = await list_partitions(conn)
+    this_month = month_start(date.today())
+    months = {month_start(this_month, shift) for shift in range(months_ahead + 1)}
+    has_default = await conn.fetchval("SELECT to_regclass($1) IS NOT NULL", DEFAULT_PARTITION)
+    if has_default:
+        months.update(row['month'] for row in await conn.fetch(f"""
+            SELECT DISTINCT date_trunc('month', created_at)::DATE AS month FROM {DEFAULT_PARTITION}
+        """))
+    created = []
+    for lower in sorted(months):
+        upper = month_start(lower, 1)
+        if any(lo < upper and lower < hi for _, lo, hi in existing):
+            continue
+        name = partition_name(lower)
+        if not has_default:
+            await conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {name} PARTITION OF {PARENT}
+                FOR VALUES FROM ('{lower}') TO ('{upper}')
+            """)
+        else:
+            # Если в секции по умолчанию есть строки этого месяца, CREATE ... PARTITION OF
+            # падает: переносим их в новую таблицу и подключаем её секцией
+            async with conn.transaction():
+                await conn.execute(f"""
+                    CREATE TABLE {name} (LIKE {PARENT} INCLUDING DEFAULTS);
+                    WITH moved AS (
+                        DELETE FROM {DEFAULT_PARTITION}
+                        WHERE created_at >= '{lower}' AND created_at < '{upper}'
+                        RETURNING *
+                    )
+                    INSERT INTO {name} SELECT * FROM moved;
+                    ALTER TABLE {PARENT} ATTACH PARTITION {name}
+                        FOR VALUES FROM ('{lower}') TO ('{upper}');
+                """)
+        created.append(name)
+    # Страховка на случай, если задача обслуживания долго не запускалась
+    await conn.execute(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {PARENT} DEFAULT")
+    if created:
+        logger.info(f"Созданы секции: {', '.join(created)}")
+    return created
+
+
+async def prepare(conn, months_ahead: int = 2):
+    # Вызывается при старте после create_tables
+    await migrate_legacy(conn)
+    # Индекс для дневного лимита; на секциях создаётся автоматически
+    await conn.execute(f"""
+        CREATE INDEX IF NOT EXISTS user_content_quota_idx ON {PARENT} (user_id, content_type, source, created_at)
+    """)
+    await ensure_partitions(conn, months_ahead)
+
+
+async def rollup_and_drop(conn, retention_months: int):
+    # Секции, целиком старше срока хранения, сворачиваются в дневные агрегаты и удаляются
+    cutoff = month_start(date.today(), -retention_months)
+    dropped = []
+    for name, _, upper in await list_partitions(conn):
+        if upper > cutoff:
+            continue
+        async with conn.transaction():
+            await conn.execute(f"""
+                INSERT INTO user_content_daily (day, content_type, source, views, viewers)
+                SELECT created_at::DATE, content_type, source, COUNT(*), COUNT(DISTINCT user_id)
+                FROM {name}
+                GROUP BY 1, 2, 3
+                ON CONFLICT (day, content_type, source) DO UPDATE
+                SET views = user_content_daily.views + EXCLUDED.views,
+                    viewers = user_content_daily.viewers + EXCLUDED.viewers;
+                ALTER TABLE {PARENT} DETACH PARTITION {name};
+                DROP TABLE {name};
+            """)
+        dropped.append(name)
+    if dropped:
+        logger.info(f"Свёрнуты и удалены секции: {', '.join(dropped)}")
+    return dropped
+
+
+async def maintain(pool, retention_months: int = 3, months_ahead: int = 2):
+    async with pool.acquire() as conn:
+        await ensure_partitions(conn, months_ahead)
+        await rollup_and_drop(conn, retention_months)
@@ -0,0 +1,59 @@
+# Фоновые задачи с ограничением параллелизма.
+# Хендлер отвечает пользователю сразу, а тяжёлую работу (отправка контента,
+# правка клавиатуры) отдаёт сюда: задачи держатся по сильной ссылке, ошибки
+# пишутся в лог, а при остановке их можно дождаться через drain().
+# Очередь ожидающих слота ограничена backlog: при наплыве нажатий лишние
+# задачи не создаются вовсе, spawn() возвращает None.
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class TaskSupervisor:
+    def __init__(self, limit: int = 32, backlog: int = 256):
+        self.limit = limit
+        self.backlog = backlog
+        self.failed = 0
+        self.rejected = 0
+        self._semaphore = None
+        self._tasks = set()
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def spawn(self, coro, name: str = None):
+        if len(self._tasks) >= self.limit + self.backlog:
+            # Корутину закрываем, иначе Python предупредит, что она не была запущена
+            coro.close()
+            self.rejected += 1
+            return None
+        if self._semaphore is None:
+            # Создаём внутри работающего цикла событий
+            self._semaphore = asyncio.Semaphore(self.limit)
+        task = asyncio.create_task(self._run(coro, name or coro.__qualname__))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _run(self, coro, name):
+        async with self._semaphore:
+            try:
+                return await coro
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Ошибка в фоновой задаче {name}: {e}")
+
+    async def drain(self, timeout: float):
+        # Ждём незавершённые задачи, по истечении таймаута отменяем оставшиеся
+        if not self._tasks:
+            return True
+        done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning(f"Отменено {len(pending)} фоновых задач при остановке.")
+            await asyncio.gather(*pending, return_exceptions=True)
+        return not pending
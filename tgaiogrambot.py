@@ -4,16 +4,35 @@ from aiogram.dispatcher.filters.state import State, StatesGroup
 import asyncio
 import os
 import logging
-from aiogram import Bot, Dispatcher, types
-from aiogram.utils import executor
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
+from aiogram import Dispatcher, types
 from dotenv import load_dotenv
 import asyncpg
 from functools import wraps
 from datetime import datetime
 import random
 import aiocron
+from metrics import metrics, MetricsMiddleware, ErrorCountingHandler, TimedBot, TimedConnection, \
+    start_metrics_server, label_handler
+from callbacks import unpack_callback
+from keyboards import KeyboardCache, MENU_KEYBOARD
+from tasks import TaskSupervisor
+from ratelimit import RateLimiter
+from edits import EditScheduler
+from ranking import ContentRanking
+from content_types import CONTENT_TABLES, CONTENT_TYPES, MEDIA_KINDS
+import retention
+from cleanup import DeletionJob
+from validator import FileValidator, is_dead_file_error, mark_dead
+import recommend
+from profiling import SamplingProfiler, TracingMiddleware, span, traced
+from throttling import UserThrottle, ThrottlingMiddleware
+from lifecycle import Lifecycle, LifecycleMiddleware, ensure_schema, warm_up, run_with_deadline
+from membership import MembershipCache
+import signal
+from time import perf_counter
+
+# Отсчёт времени старта (см. lifecycle.py)
+lifecycle = Lifecycle()
 
 
 # Configure logging
@@ -22,12 +41,73 @@ logging.basicConfig(
     level=logging.INFO
 )
 logger = logging.getLogger(__name__)
+logger.addHandler(ErrorCountingHandler(metrics))
 
 # Load environment variables
 load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Порт для /metrics (0 — не поднимать эндпоинт)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+# Апдейты дольше порога пишутся в лог с разбивкой по участкам (0 — выключено)
+SLOW_UPDATE_MS = float(os.getenv("SLOW_UPDATE_MS", "1000"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", ".")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+# Сколько фоновых задач (отправка контента, правка клавиатур) выполняется одновременно
+BACKGROUND_CONCURRENCY = int(os.getenv("BACKGROUND_CONCURRENCY", "32"))
+# и сколько может ждать своей очереди; сверх этого новые задачи отклоняются
+BACKGROUND_BACKLOG = int(os.getenv("BACKGROUND_BACKLOG", "256"))
+# Общий лимит запросов к Bot API для рассылок и правок клавиатур (в секунду)
+API_RATE_LIMIT = float(os.getenv("API_RATE_LIMIT", "25"))
+# Окно, в течение которого голоса по одному сообщению схлопываются в одну правку
+EDIT_DEBOUNCE_MS = float(os.getenv("EDIT_DEBOUNCE_MS", "1000"))
+# Режим выбора контента: random — случайный непросмотренный, ranked — с учётом
+# лайков/дизлайков и свежести (см. ranking.py), recommended — персональные
+# рекомендации из user_recommendations (см. recommend.py), затем как ranked
+CONTENT_SELECTION = os.getenv("CONTENT_SELECTION", "random")
+RANKING_REFRESH_SECONDS = float(os.getenv("RANKING_REFRESH_SECONDS", "30"))
+RANKING_RESYNC_SECONDS = float(os.getenv("RANKING_RESYNC_SECONDS", "600"))
+RANKING_HALF_LIFE_DAYS = float(os.getenv("RANKING_HALF_LIFE_DAYS", "14"))
+# Расписание пересчёта рекомендаций внутри бота (пусто — только вручную: python recommend.py)
+RECOMMEND_CRON = os.getenv("RECOMMEND_CRON", "")
+RECOMMEND_TOP_K = int(os.getenv("RECOMMEND_TOP_K", "20"))
+RECOMMEND_NEIGHBORS = int(os.getenv("RECOMMEND_NEIGHBORS", "50"))
+RECOMMEND_MEMORY_MB = int(os.getenv("RECOMMEND_MEMORY_MB", "256"))
+# Журнал просмотров user_content хранится помесячными секциями (см. retention.py):
+# сколько полных месяцев держать, на сколько месяцев вперёд создавать секции
+# и когда запускать обслуживание
+USER_CONTENT_RETENTION_MONTHS = int(os.getenv("USER_CONTENT_RETENTION_MONTHS", "3"))
+PARTITIONS_AHEAD = int(os.getenv("PARTITIONS_AHEAD", "2"))
+PARTITION_MAINTENANCE_CRON = os.getenv("PARTITION_MAINTENANCE_CRON", "15 3 * * *")
+# Фоновое удаление контента: размер пачки, пауза между пачками и как часто обновлять прогресс
+DELETE_BATCH_SIZE = int(os.getenv("DELETE_BATCH_SIZE", "500"))
+DELETE_PAUSE_MS = float(os.getenv("DELETE_PAUSE_MS", "200"))
+DELETE_PROGRESS_SECONDS = float(os.getenv("DELETE_PROGRESS_SECONDS", "5"))
+# Фоновая проверка file_id через get_file: запросов в секунду (0 — выключено),
+# размер пачки и через сколько дней перепроверять живые записи
+FILE_CHECK_RATE = float(os.getenv("FILE_CHECK_RATE", "1"))
+FILE_CHECK_BATCH = int(os.getenv("FILE_CHECK_BATCH", "100"))
+FILE_RECHECK_DAYS = float(os.getenv("FILE_RECHECK_DAYS", "7"))
+# Сколько разных единиц контента пробовать, если отправка падает из-за мёртвого file_id
+SEND_ATTEMPTS = int(os.getenv("SEND_ATTEMPTS", "5"))
+# Анти-флуд на пользователя: запросов в секунду (0 — выключено) и размер всплеска
+THROTTLE_RATE = float(os.getenv("THROTTLE_RATE", "1"))
+THROTTLE_BURST = float(os.getenv("THROTTLE_BURST", "5"))
+THROTTLE_MAX_USERS = int(os.getenv("THROTTLE_MAX_USERS", "100000"))
+# Подписки на каналы из апдейтов chat_member (бот должен быть админом каналов; 0 — старый
+# режим с get_chat_member на каждую проверку), сколько секунд доверять записи без сверки,
+# запросов в секунду на фоновую сверку и предел записей на канал
+MEMBERSHIP_EVENTS = os.getenv("MEMBERSHIP_EVENTS", "1") == "1"
+MEMBERSHIP_MAX_AGE = float(os.getenv("MEMBERSHIP_MAX_AGE", "21600"))
+MEMBERSHIP_CHECK_RATE = float(os.getenv("MEMBERSHIP_CHECK_RATE", "5"))
+MEMBERSHIP_MAX_USERS = int(os.getenv("MEMBERSHIP_MAX_USERS", "200000"))
+# Срок на корректную остановку по SIGTERM (меньше, чем ждёт оркестратор до SIGKILL)
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "25"))
+# Версия схемы: увеличить при изменении create_tables/update_tables,
+# иначе при старте создание таблиц пропускается
+SCHEMA_VERSION = 1
 
 if not BOT_TOKEN or not DATABASE_URL:
     raise ValueError("BOT_TOKEN and DATABASE_URL must be set in environment variables")
@@ -38,9 +118,25 @@ PUBLIC_CHANNELS = ["@MeminoMem"]
 user_luck = {}
 otp_video = {}
 
-bot = Bot(token=BOT_TOKEN)
+bot = TimedBot(token=BOT_TOKEN)
 dp = Dispatcher(bot)
 db_pool = None
+keyboard_cache = KeyboardCache()
+background = TaskSupervisor(limit=BACKGROUND_CONCURRENCY, backlog=BACKGROUND_BACKLOG)
+api_limiter = RateLimiter(API_RATE_LIMIT)
+edit_scheduler = EditScheduler(bot, api_limiter, delay=EDIT_DEBOUNCE_MS / 1000)
+ranking = ContentRanking(CONTENT_TABLES, half_life_days=RANKING_HALF_LIFE_DAYS)
+profiler = SamplingProfiler(interval=PROFILE_INTERVAL_MS / 1000)
+throttle = UserThrottle(rate=THROTTLE_RATE or 1, burst=THROTTLE_BURST, max_users=THROTTLE_MAX_USERS)
+membership = MembershipCache(bot, max_age=MEMBERSHIP_MAX_AGE, check_rate=MEMBERSHIP_CHECK_RATE or 1,
+                             max_users=MEMBERSHIP_MAX_USERS)
+# (user_id, content_type) с ещё не отправленным «Следующее» — повторные нажатия схлопываются
+pending_next = set()
+# content_type -> идущее удаление (DeletionJob)
+deletions = {}
+file_validator = FileValidator(bot, CONTENT_TABLES, rate=FILE_CHECK_RATE or 1, batch=FILE_CHECK_BATCH,
+                               recheck_days=FILE_RECHECK_DAYS,
+                               on_dead=lambda content_type, uids: ranking.invalidate(content_type))
 
 
 # Utility Functions
@@ -54,7 +150,7 @@ async def init_db_pool():
     retries = 3
     for attempt in range(retries):
         try:
-            db_pool = await asyncpg.create_pool(DATABASE_URL)
+            db_pool = await asyncpg.create_pool(DATABASE_URL, connection_class=TimedConnection)
             logger.info("Database connection pool created successfully.")
             break
         except Exception as e:
@@ -76,33 +172,37 @@ async def close_db_pool():
 async def create_tables():
     if not db_pool:
         logger.error("Database pool is not initialized.")
-        return
+        return False
 
     async with db_pool.acquire() as conn:
         try:
+            # Таблицы каталога — по реестру типов контента
+            for content_type in CONTENT_TYPES.values():
+                await conn.execute(content_type.create_query)
             await conn.execute("""
-                CREATE TABLE IF NOT EXISTS videos (
-                    id SERIAL PRIMARY KEY,
-                    video_id TEXT NOT NULL
-                );
-                CREATE TABLE IF NOT EXISTS memes (
-                    id SERIAL PRIMARY KEY,
-                    meme_id TEXT NOT NULL
-                );
-                CREATE TABLE IF NOT EXISTS stickers (
-                    id SERIAL PRIMARY KEY,
-                    sticker_id TEXT NOT NULL
-                );
-                CREATE TABLE IF NOT EXISTS voice_messages (
-                    id SERIAL PRIMARY KEY,
-                    voice_id TEXT NOT NULL
-                );
                 CREATE TABLE IF NOT EXISTS user_content (
                     user_id BIGINT NOT NULL,
                     content_id TEXT NOT NULL,
                     content_type TEXT NOT NULL,
                     source TEXT NOT NULL,
-                    UNIQUE (user_id, content_id, content_type, source)
+                    created_at TIMESTAMP NOT NULL DEFAULT NOW()
+                ) PARTITION BY RANGE (created_at);
+                CREATE TABLE IF NOT EXISTS user_content_seen (
+                    user_id BIGINT NOT NULL,
+                    content_type TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    content_id TEXT NOT NULL,
+                    PRIMARY KEY (user_id, content_type, source, content_id)
+                );
+                CREATE INDEX IF NOT EXISTS user_content_seen_content_idx
+                    ON user_content_seen (content_type, content_id);
+                CREATE TABLE IF NOT EXISTS user_content_daily (
+                    day DATE NOT NULL,
+                    content_type TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    views BIGINT NOT NULL,
+                    viewers BIGINT NOT NULL,
+                    PRIMARY KEY (day, content_type, source)
                 );
                 CREATE TABLE IF NOT EXISTS content_feedback (
                     id SERIAL PRIMARY KEY,
@@ -119,21 +219,33 @@ async def create_tables():
                     feedback_type TEXT NOT NULL, -- 'like' или 'dislike'
                     PRIMARY KEY (user_id, content_id, content_type)
                 );
+                CREATE INDEX IF NOT EXISTS user_feedback_content_idx ON user_feedback (content_type, content_id);
                 CREATE TABLE IF NOT EXISTS bot_users (
                     user_id BIGINT PRIMARY KEY,
                     username TEXT,
                     joined_at TIMESTAMP DEFAULT NOW()
                 );
+                CREATE TABLE IF NOT EXISTS user_recommendations (
+                    user_id BIGINT NOT NULL,
+                    content_type TEXT NOT NULL,
+                    rank SMALLINT NOT NULL,
+                    content_uid INTEGER NOT NULL,
+                    content_id TEXT NOT NULL,
+                    score REAL NOT NULL,
+                    PRIMARY KEY (user_id, content_type, rank)
+                );
             """)
             logger.info("Tables created successfully.")
+            return True
         except Exception as e:
             logger.error(f"Error creating tables: {e}")
+            return False
 
 
 async def update_tables():
     if not db_pool:
         logger.error("Database pool is not initialized.")
-        return
+        return False
 
     async with db_pool.acquire() as conn:
         try:
@@ -151,19 +263,46 @@ async def update_tables():
                 END $$;
             """)
             logger.info("Table user_content updated successfully.")
+            # Дата добавления контента нужна для затухания рейтинга. Колонку добавляем
+            # без default, чтобы старые строки остались NULL («возраст неизвестен, старое»),
+            # а не получили время миграции; default ставим отдельно — для новых строк
+            for content_type, table_name in CONTENT_TABLES.items():
+                await conn.execute(f"""
+                    ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS created_at TIMESTAMP;
+                    ALTER TABLE {table_name} ALTER COLUMN created_at SET DEFAULT NOW();
+                """)
+                # Поиск по file_id нужен каскадному удалению (см. cleanup.py)
+                await conn.execute(f"""
+                    CREATE INDEX IF NOT EXISTS {table_name}_{content_type}_id_idx ON {table_name} ({content_type}_id);
+                """)
+                # Результаты проверки file_id (см. validator.py)
+                await conn.execute(f"""
+                    ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS checked_at TIMESTAMP;
+                    ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS dead_at TIMESTAMP;
+                    CREATE INDEX IF NOT EXISTS {table_name}_checked_idx
+                        ON {table_name} (checked_at NULLS FIRST, id) WHERE dead_at IS NULL;
+                """)
+            logger.info("Content tables updated successfully.")
+            await retention.prepare(conn, PARTITIONS_AHEAD)
+            return True
         except Exception as e:
             logger.error(f"Error updating tables: {e}")
+            return False
+
+
+async def migrate_schema():
+    return await create_tables() and await update_tables()
 
 
 # Subscription Check
-async def is_subscribed(user_id: int) -> bool:
+async def is_subscribed(user_id: int, fresh: bool = False) -> bool:
+    # Обычно ответ из кэша membership; fresh — спросить Telegram (кнопка «Я подписался»)
     for channel in PUBLIC_CHANNELS:
         try:
-            status = await bot.get_chat_member(chat_id=channel, user_id=user_id)
-            if status.status not in ["member", "administrator", "creator"]:
+            if not await membership.is_member(channel, user_id, fresh=fresh or not MEMBERSHIP_EVENTS):
                 return False
         except Exception as e:
-            print(f"Error checking channel {channel}: {e}")
+            logger.error(f"Ошибка при проверке подписки на {channel}: {e}")
             return False
     return True
 
@@ -172,24 +311,34 @@ def subscription_required(handler):
     @wraps(handler)
     async def wrapper(message: types.Message, *args, **kwargs):
         user_id = message.from_user.id
-        if await is_subscribed(user_id):
+        with span('subscription'):
+            subscribed = await is_subscribed(user_id)
+        if subscribed:
             return await handler(message, *args, **kwargs)
         else:
-            # Динамическое создание кнопок для каждого канала
-            markup = InlineKeyboardMarkup()
-            for channel in PUBLIC_CHANNELS:
-                channel_link = f"https://t.me/{channel.lstrip('@')}"
-                markup.row(InlineKeyboardButton(channel, url=channel_link))
-            markup.row(
-                InlineKeyboardButton('\u2705 Проверить подписку', callback_data='check_subscription')
-            )
+            # Кнопки для каждого канала, пересобираются только при изменении списка
+            markup = keyboard_cache.subscription_keyboard(PUBLIC_CHANNELS)
             await message.reply("Для работы бота требуется подписка на эти каналы:", reply_markup=markup)
     return wrapper
 
 
-async def send_content(message: types.Message, content_type: str, table_name: str, uid: int = None,
-                       source: str = "command"):
-    user_id = message.from_user.id
+# Запросы send_content вынесены в константы (запросы по типам — в content_types.py),
+# чтобы прогрев при старте подготовил ровно те же тексты в кэше asyncpg (см. warm_statements)
+QUOTA_QUERY = """
+    SELECT COUNT(*) FROM user_content
+    WHERE user_id = $1 AND content_type = $2 AND source = $3
+    AND created_at >= $4 AND created_at < $4 + INTERVAL '1 day'
+"""
+FEEDBACK_QUERY = """
+    SELECT likes, dislikes FROM content_feedback
+    WHERE content_id = $1 AND content_type = $2
+"""
+
+
+async def send_content(message: types.Message, content_type: str, uid: int = None,
+                       source: str = "command", user_id: int = None):
+    user_id = user_id or message.from_user.id
+    kind = CONTENT_TYPES[content_type]
     today = datetime.now().date()  # Текущая дата
 
     try:
@@ -197,73 +346,87 @@ async def send_content(message: types.Message, content_type: str, table_name: st
             # Пропускаем проверку лимита для ALLOWED_USERS
             if user_id not in ALLOWED_USERS:
                 # Проверяем, сколько раз пользователь уже получил данный тип контента сегодня
-                daily_count = await conn.fetchval("""
-                    SELECT COUNT(*) FROM user_content
-                    WHERE user_id = $1 AND content_type = $2 AND source = $3 AND DATE(created_at) = $4
-                """, user_id, content_type, source, today)
+                with span('quota'):
+                    daily_count = await conn.fetchval(QUOTA_QUERY, user_id, content_type, source,
+                                                      datetime.combine(today, datetime.min.time()))
 
                 if daily_count >= 15:
                     await message.reply(
                         f"Вы достигли дневного лимита в 15 {content_type} за сегодня. Попробуйте завтра.")
                     return
 
-            # Выбор контента
-            if uid is not None:
-                result = await conn.fetchrow(f"""
-                    SELECT {content_type}_id FROM {table_name} WHERE id = $1
-                """, uid)
-            else:
-                result = await conn.fetchrow(f"""
-                    SELECT v.id, v.{content_type}_id FROM {table_name} v
-                    LEFT JOIN user_content uc 
-                    ON v.{content_type}_id = uc.content_id 
-                    AND uc.user_id = $1 
-                    AND uc.content_type = $2
-                    AND uc.source = $3
-                    WHERE uc.content_id IS NULL
-                    ORDER BY RANDOM() LIMIT 1
-                """, user_id, content_type, source)
-
-            if result:
-                content_id = result[f"{content_type}_id"]
-                uid = uid or result["id"]
+            # Выбор и отправка; мёртвый file_id помечаем и пробуем другую единицу контента.
+            # Если просили конкретный id, замену не подсовываем — сообщаем, что его нет
+            requested = uid
+            result = None
+            skipped = set()
+            for attempt in range(SEND_ATTEMPTS):
+                with span('pick'):
+                    if uid is not None:
+                        result = await conn.fetchrow(kind.by_id_query, uid)
+                        uid = None
+                    else:
+                        result = None
+                        if CONTENT_SELECTION == 'recommended':
+                            # Лучшая непросмотренная рекомендация из последнего пересчёта
+                            result = await recommend.pick_recommended(conn, content_type, user_id, source)
+                        if result is None and CONTENT_SELECTION in ('ranked', 'recommended'):
+                            # Взвешенный выбор из памяти; если все кандидаты уже просмотрены — случайный
+                            result = await ranking.pick_unseen(conn, content_type, user_id, source)
+                        if result is None or result['id'] in skipped:
+                            result = await conn.fetchrow(kind.random_query, user_id, content_type, source)
+
+                if not result:
+                    break
+                content_id = result[kind.column]
+                content_uid = result["id"]
 
                 # Получение лайков/дизлайков
-                feedback = await conn.fetchrow("""
-                    SELECT likes, dislikes FROM content_feedback
-                    WHERE content_id = $1 AND content_type = $2
-                """, content_id, content_type)
+                with span('feedback'):
+                    feedback = await conn.fetchrow(FEEDBACK_QUERY, content_id, content_type)
 
                 likes = feedback['likes'] if feedback else 0
                 dislikes = feedback['dislikes'] if feedback else 0
 
-                # Создаём клавиатуру
-                keyboard = InlineKeyboardMarkup()
-                keyboard.row(
-                    InlineKeyboardButton(f"👍 {likes}", callback_data=f"like_{content_type}_{uid}"),
-                    InlineKeyboardButton(f"👎 {dislikes}", callback_data=f"dislike_{content_type}_{uid}")
-                )
-
-                keyboard.add(InlineKeyboardButton("➡️ Следующее", callback_data=f"next_{content_type}"))
+                # Готовая клавиатура из кэша
+                keyboard = keyboard_cache.vote_keyboard(content_type, content_uid, likes, dislikes)
 
                 # Отправляем контент
-                if content_type == "video":
-                    await bot.send_video(message.chat.id, content_id, reply_markup=keyboard)
-                elif content_type == "meme":
-                    await bot.send_photo(message.chat.id, content_id, reply_markup=keyboard)
-                elif content_type == "sticker":
-                    await bot.send_sticker(message.chat.id, content_id, reply_markup=keyboard)
-                elif content_type == "voice":
-                    await bot.send_voice(message.chat.id, content_id, reply_markup=keyboard)
+                try:
+                    with span('send'):
+                        await kind.send(bot, message.chat.id, content_id, reply_markup=keyboard)
+                except Exception as e:
+                    if not is_dead_file_error(e):
+                        raise
+                    logger.warning(f"Мёртвый {content_type} {content_uid} пропущен: {e}")
+                    await mark_dead(conn, kind.table, [content_uid])
+                    ranking.invalidate(content_type)
+                    skipped.add(content_uid)
+                    result = None
+                    if requested is not None:
+                        break
+                    continue
 
                 # Сохраняем просмотр контента
-                await conn.execute("""
-                    INSERT INTO user_content (user_id, content_id, content_type, source, created_at)
-                    VALUES ($1, $2, $3, $4, NOW())
-                    ON CONFLICT DO NOTHING
-                """, user_id, content_id, content_type, source)
-            else:
-                await message.reply(f"No available {content_type} to send.")
+                with span('insert'):
+                    # В журнал пишется только первый просмотр, как и раньше с UNIQUE
+                    await conn.execute("""
+                        WITH seen AS (
+                            INSERT INTO user_content_seen (user_id, content_type, source, content_id)
+                            VALUES ($1, $3, $4, $2)
+                            ON CONFLICT DO NOTHING
+                            RETURNING 1
+                        )
+                        INSERT INTO user_content (user_id, content_id, content_type, source, created_at)
+                        SELECT $1, $2, $3, $4, NOW() FROM seen
+                    """, user_id, content_id, content_type, source)
+                break
+
+            if not result:
+                if requested is not None:
+                    await message.reply(f"{content_type.capitalize()} {requested} недоступен.")
+                else:
+                    await message.reply(f"No available {content_type} to send.")
 
     except Exception as e:
         logger.error(f"Error getting {content_type}: {e}")
@@ -273,6 +436,26 @@ async def send_content(message: types.Message, content_type: str, table_name: st
 # Инициализация MemoryStorage
 storage = MemoryStorage()
 dp = Dispatcher(bot, storage=storage)
+dp.middleware.setup(LifecycleMiddleware(lifecycle))
+dp.middleware.setup(MetricsMiddleware(metrics))
+if THROTTLE_RATE:
+    dp.middleware.setup(ThrottlingMiddleware(throttle))
+metrics.gauges['bot_keyboard_cache_size'] = lambda: len(keyboard_cache)
+metrics.gauges['bot_background_tasks'] = lambda: len(background)
+metrics.counters['bot_background_rejected_total'] = lambda: background.rejected
+metrics.gauges['bot_pending_markup_edits'] = lambda: len(edit_scheduler)
+metrics.counters['bot_files_checked_total'] = lambda: file_validator.checked
+metrics.counters['bot_files_dead_total'] = lambda: file_validator.dead
+metrics.counters['bot_throttled_total'] = lambda: throttle.dropped
+metrics.gauges['bot_throttle_users'] = lambda: len(throttle)
+metrics.gauges['bot_membership_entries'] = lambda: len(membership)
+metrics.counters['bot_membership_hits_total'] = lambda: membership.hits
+metrics.counters['bot_membership_misses_total'] = lambda: membership.misses
+metrics.counters['bot_membership_events_total'] = lambda: membership.events
+metrics.gauges['bot_startup_seconds'] = lambda: lifecycle.startup_seconds
+metrics.gauges['bot_first_update_seconds'] = lambda: lifecycle.first_update_seconds
+if SLOW_UPDATE_MS:
+    dp.middleware.setup(TracingMiddleware(SLOW_UPDATE_MS / 1000))
 
 
 # Определение состояний
@@ -281,7 +464,7 @@ class AddContentState(StatesGroup):
 
 
 # Команда для начала добавления контента
-@dp.message_handler(commands=['addvideo', 'addmeme', 'addsticker', 'addvoice'])
+@dp.message_handler(commands=[f'add{content_type}' for content_type in CONTENT_TYPES])
 async def start_adding_content(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
     if user_id not in ALLOWED_USERS:
@@ -304,34 +487,20 @@ async def start_adding_content(message: types.Message, state: FSMContext):
 async def add_content(message: types.Message, state: FSMContext):
     user_data = await state.get_data()
     content_type = user_data.get('content_type')
-    table_name = None
-    content_id = None
-
-    # Определяем таблицу и получаем ID контента
-    if content_type == "video" and message.video:
-        table_name = "videos"
-        content_id = message.video.file_id
-    elif content_type == "meme" and message.photo:
-        table_name = "memes"
-        content_id = message.photo[-1].file_id
-    elif content_type == "sticker" and message.sticker:
-        table_name = "stickers"
-        content_id = message.sticker.file_id
-    elif content_type == "voice" and message.voice:
-        table_name = "voice_messages"
-        content_id = message.voice.file_id
-
-    if not table_name or not content_id:
+    kind = CONTENT_TYPES.get(content_type)
+
+    # Берём file_id из вложения того вида, что хранится в таблице типа
+    content_id = kind.file_id(message) if kind else None
+
+    if not content_id:
         await message.reply("Отправленный контент не подходит. Попробуйте снова.")
         return
 
     # Сохранение контента в базу данных
     try:
         async with db_pool.acquire() as conn:
-            await conn.execute(f"""
-                INSERT INTO {table_name} ({content_type}_id) VALUES ($1)
-                ON CONFLICT DO NOTHING
-            """, content_id)
+            await conn.execute(kind.insert_query, content_id)
+        ranking.invalidate(content_type)
         await message.reply(f"{content_type.capitalize()} успешно добавлено.")
     except Exception as e:
         logger.error(f"Ошибка при добавлении {content_type}: {e}")
@@ -402,6 +571,7 @@ async def add_channel_command(message: types.Message):
             await message.reply(f"Канал {channel} уже есть в списке.")
         else:
             PUBLIC_CHANNELS.append(channel)
+            await membership.resolve([channel])
             await message.reply(f"Канал {channel} добавлен в список проверки.")
     except IndexError:
         await message.reply("Пожалуйста, укажите название канала. Пример: /add_channel @example_channel")
@@ -422,6 +592,7 @@ async def minus_channel_command(message: types.Message):
             return
         if channel in PUBLIC_CHANNELS:
             PUBLIC_CHANNELS.remove(channel)
+            membership.forget(channel)
             await message.reply(f"Канал {channel} теперь нет в списке.")
         else:
             await message.reply(f"Канал {channel} не было в списке")
@@ -442,24 +613,17 @@ async def list_channels_command(message: types.Message):
         await message.reply("Список каналов пуст.")
 
 
+@dp.chat_member_handler()
+async def handle_chat_member(update: types.ChatMemberUpdated):
+    # Вступления и выходы из каналов PUBLIC_CHANNELS; остальные чаты игнорируются
+    membership.on_chat_member(update)
+
+
 
 @dp.message_handler(commands=['menu'])
 @subscription_required
 async def show_menu(message: types.Message):
-    # Создаем клавиатуру
-    menu_keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
-    menu_keyboard.add(
-        KeyboardButton('🎥 Видео'),
-        KeyboardButton('🖼️ Мемы')
-    )
-    menu_keyboard.add(
-        KeyboardButton('📦 Стикеры'),
-        KeyboardButton('🎙️ Голосовухи')
-    )
-    menu_keyboard.add(
-        KeyboardButton('🍀 Узнать уровень удачи'),
-    )
-    await message.reply("Выберите категорию:", reply_markup=menu_keyboard)
+    await message.reply("Выберите категорию:", reply_markup=MENU_KEYBOARD)
 
 
 @dp.message_handler(commands=['start'])
@@ -469,26 +633,18 @@ async def privetsvie(message: types.Message):
                            'Приветствую вас в нашем боте!\nБот умеет присылать вам прикольные видео, мемы, стикеры, смешные голосовые сообщение)\nПриятного пользования нашим ботом!\nУдачи!!!')
 
 
-@dp.message_handler(
-    lambda message: message.text in ['🎥 Видео', '🖼️ Мемы', '📦 Стикеры', '🎙️ Голосовухи', '🍀 Узнать уровень удачи'])
+# Кнопки меню -> хендлер (MENU_ROUTES заполняется ниже, после объявления хендлеров)
+@dp.message_handler(lambda message: message.text in MENU_ROUTES)
 async def handle_menu_selection(message: types.Message):
-    if message.text == '🎥 Видео':
-        await handle_video_command(message)
-    elif message.text == '🖼️ Мемы':
-        await handle_memes_command(message)
-    elif message.text == '📦 Стикеры':
-        await handle_sticker(message)
-    elif message.text == '🎙️ Голосовухи':
-        await handle_voice(message)
-    elif message.text == '🍀 Узнать уровень удачи':
-        await luck(message)
-
-
-@dp.callback_query_handler(lambda c: c.data == 'check_subscription')
+    handler = MENU_ROUTES[message.text]
+    label_handler(handler)
+    await handler(message)
+
+
 async def check_subscription_handler(callback_query: types.CallbackQuery):
     user_id = callback_query.from_user.id
     msg = callback_query.message  # Объект сообщения
-    if await is_subscribed(user_id):
+    if await is_subscribed(user_id, fresh=True):
         await callback_query.answer("Вы подписаны!", show_alert=True)
 
         # Удаление сообщения
@@ -510,7 +666,7 @@ async def check_subscription_handler(callback_query: types.CallbackQuery):
 async def handle_video_command(message: types.Message):
     args = message.get_args()
     uid = int(args) if args and args.isdigit() else None
-    await send_content(message, "video", "videos", uid, "command")
+    await send_content(message, "video", uid, "command")
 
 
 @dp.message_handler(commands=['memes'])
@@ -518,7 +674,7 @@ async def handle_video_command(message: types.Message):
 async def handle_memes_command(message: types.Message):
     args = message.get_args()
     uid = int(args) if args and args.isdigit() else None
-    await send_content(message, "meme", "memes", uid, "command")
+    await send_content(message, "meme", uid, "command")
 
 
 @dp.message_handler(commands=['stickers', 's'])
@@ -526,7 +682,7 @@ async def handle_memes_command(message: types.Message):
 async def handle_sticker(message: types.Message):
     args = message.get_args()
     uid = int(args) if args and args.isdigit() else None
-    await send_content(message, "sticker", "stickers", uid, "command")
+    await send_content(message, "sticker", uid, "command")
 
 
 @dp.message_handler(commands=['voice', 'vo'])
@@ -534,7 +690,7 @@ async def handle_sticker(message: types.Message):
 async def handle_voice(message: types.Message):
     args = message.get_args()
     uid = int(args) if args and args.isdigit() else None
-    await send_content(message, "voice", "voice_messages", uid, "command")
+    await send_content(message, "voice", uid, "command")
 
 
 @dp.message_handler(commands=['luck'])
@@ -629,110 +785,184 @@ async def luck(message: types.Message):
     await message.reply(response)
 
 
-@dp.callback_query_handler(lambda c: c.data.startswith(('like_', 'dislike_')))
-async def handle_like_dislike(callback_query: types.CallbackQuery):
-    data = callback_query.data.split('_')
-    action = data[0]  # 'like' или 'dislike'
-    content_type = data[1]
-    uid = int(data[2])
+MENU_ROUTES = {
+    '🎥 Видео': handle_video_command,
+    '🖼️ Мемы': handle_memes_command,
+    '📦 Стикеры': handle_sticker,
+    '🎙️ Голосовухи': handle_voice,
+    '🍀 Узнать уровень удачи': luck,
+}
+
+
+async def handle_like_dislike(callback_query: types.CallbackQuery, action: str, content_type: str, uid: int):
     user_id = callback_query.from_user.id
+    answered = False
 
     try:
         async with db_pool.acquire() as conn:
             # Получаем content_id по uid
-            result = await conn.fetchrow(f"""
-                SELECT {content_type}_id FROM {content_type}s WHERE id = $1
-            """, uid)
-            if not result:
+            content_id = await conn.fetchval(CONTENT_TYPES[content_type].file_id_query, uid)
+            if not content_id:
                 await callback_query.answer("Контент не найден.", show_alert=True)
                 return
 
-            content_id = result[f"{content_type}_id"]
+            async with conn.transaction():
+                # Сохраняем голос пользователя; повторный голос упрётся в PRIMARY KEY
+                voted = await conn.fetchval("""
+                    INSERT INTO user_feedback (user_id, content_id, content_type, feedback_type)
+                    VALUES ($1, $2, $3, $4)
+                    ON CONFLICT DO NOTHING
+                    RETURNING 1
+                """, user_id, content_id, content_type, action)
+
+                if voted:
+                    # Добавляем голос и сразу получаем новые счётчики
+                    feedback = await conn.fetchrow(f"""
+                        INSERT INTO content_feedback (content_id, content_type, {action}s)
+                        VALUES ($1, $2, 1)
+                        ON CONFLICT (content_id, content_type)
+                        DO UPDATE SET {action}s = content_feedback.{action}s + 1
+                        RETURNING likes, dislikes
+                    """, content_id, content_type)
+
+        if not voted:
+            await callback_query.answer("Вы уже голосовали за этот контент!", show_alert=True)
+            return
+        ranking.record_vote(content_type, uid, feedback['likes'], feedback['dislikes'])
 
-            # Проверяем, голосовал ли пользователь за этот контент
-            feedback_check = await conn.fetchrow("""
-                SELECT feedback_type FROM user_feedback
-                WHERE user_id = $1 AND content_id = $2 AND content_type = $3
-            """, user_id, content_id, content_type)
+        # Отвечаем сразу, клавиатуру правим отложенно с последними счётчиками
+        await callback_query.answer("Ваш голос учтён!")
+        answered = True
+        keyboard = keyboard_cache.vote_keyboard(content_type, uid, feedback['likes'], feedback['dislikes'])
+        edit_scheduler.schedule(callback_query.message.chat.id, callback_query.message.message_id, keyboard)
+    except Exception as e:
+        logger.error(f"Ошибка обработки {action}: {e}")
+        if not answered:
+            await callback_query.answer("Ошибка обработки.", show_alert=True)
 
-            if feedback_check:
-                await callback_query.answer("Вы уже голосовали за этот контент!", show_alert=True)
-                return
 
-            # Добавляем голос
-            if action == 'like':
-                await conn.execute("""
-                    INSERT INTO content_feedback (content_id, content_type, likes)
-                    VALUES ($1, $2, 1)
-                    ON CONFLICT (content_id, content_type)
-                    DO UPDATE SET likes = content_feedback.likes + 1
-                """, content_id, content_type)
-                feedback_type = 'like'
-            elif action == 'dislike':
-                await conn.execute("""
-                    INSERT INTO content_feedback (content_id, content_type, dislikes)
-                    VALUES ($1, $2, 1)
-                    ON CONFLICT (content_id, content_type)
-                    DO UPDATE SET dislikes = content_feedback.dislikes + 1
-                """, content_id, content_type)
-                feedback_type = 'dislike'
-
-            # Сохраняем информацию о голосовании пользователя
-            await conn.execute("""
-                INSERT INTO user_feedback (user_id, content_id, content_type, feedback_type)
-                VALUES ($1, $2, $3, $4)
-            """, user_id, content_id, content_type, feedback_type)
-
-            # Получаем обновленные данные лайков/дизлайков
-            feedback = await conn.fetchrow("""
-                SELECT likes, dislikes FROM content_feedback
-                WHERE content_id = $1 AND content_type = $2
-            """, content_id, content_type)
-            likes = feedback['likes']
-            dislikes = feedback['dislikes']
-
-            # Обновляем клавиатуру
-            keyboard = InlineKeyboardMarkup()
-            keyboard.row(
-                InlineKeyboardButton(f"👍 {likes}", callback_data=f"like_{content_type}_{uid}"),
-                InlineKeyboardButton(f"👎 {dislikes}", callback_data=f"dislike_{content_type}_{uid}")
-            )
-            keyboard.add(InlineKeyboardButton("➡️ Следующее", callback_data=f"next_{content_type}"))
-
-            # Редактируем сообщение
-            await bot.edit_message_reply_markup(
-                chat_id=callback_query.message.chat.id,
-                message_id=callback_query.message.message_id,
-                reply_markup=keyboard
-            )
-
-            await callback_query.answer("Ваш голос учтён!")
+async def handle_next_callback(callback_query: types.CallbackQuery, action: str, content_type: str, uid: int):
+    if content_type in CONTENT_TYPES:
+        # callback_query.message отправлено ботом, поэтому пользователя берём из колбэка.
+        key = (callback_query.from_user.id, content_type)
+        if key in pending_next:
+            await callback_query.answer("Уже отправляю…")
+            return
+        pending_next.add(key)
+        send = coro = send_content(callback_query.message, content_type=content_type, source="callback", user_id=key[0])
+        if SLOW_UPDATE_MS:
+            # Отправка идёт уже после TracingMiddleware, поэтому медленную отправку трассируем отдельно
+            coro = traced(send, f"send_content (колбэк {callback_query.id})", SLOW_UPDATE_MS / 1000,
+                          queued=perf_counter())
+        task = background.spawn(coro, name='send_content')
+        if task is None:
+            # spawn закрывает только обёртку, саму отправку закрываем сами
+            send.close()
+            pending_next.discard(key)
+            await callback_query.answer("Бот перегружен, попробуйте чуть позже.")
+            return
+        task.add_done_callback(lambda _: pending_next.discard(key))
+        # Убираем «часики» на кнопке сразу, контент отправляется в фоне.
+        await callback_query.answer()
+    else:
+        await callback_query.answer("Unknown content type.", show_alert=True)
+
+
+# Кнопки с фиксированными данными
+CALLBACK_ROUTES = {
+    'check_subscription': check_subscription_handler,
+}
+# Кнопки под контентом (см. callbacks.py): действие -> хендлер
+CONTENT_CALLBACK_ROUTES = {
+    'like': handle_like_dislike,
+    'dislike': handle_like_dislike,
+    'next': handle_next_callback,
+}
+
+
+# Единственный обработчик колбэков: один разбор данных и один поиск в словаре
+@dp.callback_query_handler()
+async def route_callback(callback_query: types.CallbackQuery):
+    data = callback_query.data or ''
+    handler = CALLBACK_ROUTES.get(data)
+    if handler is not None:
+        label_handler(handler)
+        await handler(callback_query)
+        return
+
+    route = unpack_callback(data)
+    if route is None:
+        await callback_query.answer()
+        return
+    handler = CONTENT_CALLBACK_ROUTES[route[0]]
+    label_handler(handler)
+    await handler(callback_query, *route)
+
+
+async def report_deletion(job: DeletionJob, progress_message: types.Message):
+    # Прогресс правим не чаще раза в DELETE_PROGRESS_SECONDS
+    last_report = 0.0
+
+    async def on_progress(job):
+        nonlocal last_report
+        now = asyncio.get_running_loop().time()
+        if now - last_report < DELETE_PROGRESS_SECONDS:
+            return
+        last_report = now
+        await api_limiter.acquire()
+        try:
+            await progress_message.edit_text(f"⏳ {job.progress()}")
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении прогресса удаления: {e}")
+
+    text = None
+    try:
+        await job.run(db_pool, on_progress=on_progress)
+        text = f"✅ {job.progress()}"
+    except asyncio.CancelledError:
+        text = f"⛔ Остановлено — {job.progress()}"
+        raise
     except Exception as e:
-        logger.error(f"Ошибка обработки {action}: {e}")
-        await callback_query.answer("Ошибка обработки.", show_alert=True)
-
-
-# Обработчик колбэков для лайков, дизлайков и следующего
-@dp.callback_query_handler(lambda c: c.data.startswith(('like_', 'dislike_', 'next_')))
-async def handle_callback_query(callback_query: types.CallbackQuery):
-    data = callback_query.data.split('_')
-    action = data[0]  # like, dislike, next
-    content_type = data[1]
-
-    if action == 'next':
-        table_map = {
-            "video": "videos",
-            "meme": "memes",
-            "sticker": "stickers",
-            "voice": "voice_messages"
-        }
-        table_name = table_map.get(content_type)
-
-        if table_name:
-            await send_content(callback_query.message, content_type=content_type, table_name=table_name,
-                               source="callback")
-        else:
-            await callback_query.answer("Unknown content type.", show_alert=True)
+        logger.error(f"Ошибка при удалении {job.describe()}: {e}")
+        text = f"❌ Ошибка: {e}\n{job.progress()}"
+    finally:
+        ranking.invalidate(job.content_type)
+        if text:
+            try:
+                await progress_message.edit_text(text)
+            except Exception as e:
+                logger.error(f"Ошибка при обновлении прогресса удаления: {e}")
+
+
+async def start_deletion(message: types.Message, content_type: str, min_id: int = None, max_id: int = None,
+                         older_than_days: int = None):
+    if content_type in deletions:
+        await message.reply(f"Удаление уже идёт — {deletions[content_type].progress()}")
+        return
+    job = DeletionJob(content_type, CONTENT_TABLES[content_type], min_id=min_id, max_id=max_id,
+                      older_than_days=older_than_days, batch_size=DELETE_BATCH_SIZE,
+                      pause=DELETE_PAUSE_MS / 1000)
+    try:
+        async with db_pool.acquire() as conn:
+            await job.count(conn)
+    except Exception as e:
+        logger.error(f"Ошибка при подсчёте контента для удаления: {e}")
+        await message.reply(f"Не удалось начать удаление: {e}")
+        return
+    if not job.total:
+        await message.reply(f"Нечего удалять: {job.describe()}.")
+        return
+    deletions[content_type] = job
+    progress_message = await message.reply(f"⏳ Удаление запущено — {job.progress()}")
+    # Своя задача, а не background: долгое удаление не должно занимать слот отправок.
+    # Запись снимаем в колбэке — он сработает, даже если задачу отменили до старта
+    job.task = asyncio.create_task(report_deletion(job, progress_message), name=f"delete_{content_type}")
+    job.task.add_done_callback(lambda _: finish_deletion(job))
+
+
+def finish_deletion(job: DeletionJob):
+    if deletions.get(job.content_type) is job:
+        del deletions[job.content_type]
 
 
 @dp.message_handler(commands=['delete_all_videos'])
@@ -741,14 +971,7 @@ async def delete_all_videos(message: types.Message):
     if user_id not in glava:
         await message.reply("У вас нет прав на выполнение этой команды.")
         return
-
-    try:
-        async with db_pool.acquire() as conn:
-            await conn.execute("DELETE FROM videos")
-        await message.reply("Все видео успешно удалены из базы данных.")
-    except Exception as e:
-        logger.error(f"Ошибка при удалении видео: {e}")
-        await message.reply(f"Не удалось удалить видео: {e}")
+    await start_deletion(message, "video")
 
 
 @dp.message_handler(commands=['delete_all_memes'])
@@ -757,14 +980,7 @@ async def delete_all_memes(message: types.Message):
     if user_id not in glava:
         await message.reply("У вас нет прав на выполнение этой команды.")
         return
-
-    try:
-        async with db_pool.acquire() as conn:
-            await conn.execute("DELETE FROM memes")
-        await message.reply("Все мемы успешно удалены из базы данных.")
-    except Exception as e:
-        logger.error(f"Ошибка при удалении мемов: {e}")
-        await message.reply(f"Не удалось удалить мемы: {e}")
+    await start_deletion(message, "meme")
 
 
 @dp.message_handler(commands=['delete_all_stickers'])
@@ -773,14 +989,7 @@ async def delete_all_stickers(message: types.Message):
     if user_id not in glava:
         await message.reply("У вас нет прав на выполнение этой команды.")
         return
-
-    try:
-        async with db_pool.acquire() as conn:
-            await conn.execute("DELETE FROM stickers")
-        await message.reply("Все стикеры успешно удалены из базы данных.")
-    except Exception as e:
-        logger.error(f"Ошибка при удалении стикеров: {e}")
-        await message.reply(f"Не удалось удалить стикеры: {e}")
+    await start_deletion(message, "sticker")
 
 
 @dp.message_handler(commands=['delete_all_voice'])
@@ -789,14 +998,68 @@ async def delete_all_voice(message: types.Message):
     if user_id not in glava:
         await message.reply("У вас нет прав на выполнение этой команды.")
         return
+    await start_deletion(message, "voice")
 
-    try:
-        async with db_pool.acquire() as conn:
-            await conn.execute("DELETE FROM voice_messages")
-        await message.reply("Все голосовые сообщения успешно удалены из базы данных.")
-    except Exception as e:
-        logger.error(f"Ошибка при удалении голосовых сообщений: {e}")
-        await message.reply(f"Не удалось удалить голосовые сообщения: {e}")
+
+# /delete_content <тип> [<от>-<до>] [<N>d] — например /delete_content meme 100-500 или /delete_content video 90d
+@dp.message_handler(commands=['delete_content'])
+async def delete_content(message: types.Message):
+    user_id = message.from_user.id
+    if user_id not in glava:
+        await message.reply("У вас нет прав на выполнение этой команды.")
+        return
+
+    args = message.get_args().split()
+    usage = f"Использование: /delete_content <{'|'.join(CONTENT_TABLES)}> [от-до] [Nd]"
+    if not args or args[0] not in CONTENT_TABLES:
+        await message.reply(usage)
+        return
+    filters = {}
+    for arg in args[1:]:
+        if arg.endswith('d') and arg[:-1].isdigit():
+            filters['older_than_days'] = int(arg[:-1])
+        elif '-' in arg and arg != '-' and all(part.isdigit() or not part for part in arg.split('-', 1)):
+            # Одна из границ может быть пустой («100-», «-500»), но не обе: «-» — это не «весь каталог»
+            low, high = arg.split('-', 1)
+            filters['min_id'] = int(low) if low else None
+            filters['max_id'] = int(high) if high else None
+        else:
+            await message.reply(usage)
+            return
+    await start_deletion(message, args[0], **filters)
+
+
+@dp.message_handler(commands=['delete_status'])
+async def delete_status(message: types.Message):
+    if message.from_user.id not in glava:
+        await message.reply("У вас нет прав на выполнение этой команды.")
+        return
+    if not deletions:
+        await message.reply("Удалений не идёт.")
+        return
+    await message.reply("\n".join(f"⏳ {job.progress()}" for job in deletions.values()))
+
+
+@dp.message_handler(commands=['delete_cancel'])
+async def delete_cancel(message: types.Message):
+    if message.from_user.id not in glava:
+        await message.reply("У вас нет прав на выполнение этой команды.")
+        return
+    content_type = message.get_args().strip()
+    if content_type:
+        # Без аргумента — отменяем всё; с аргументом — только этот тип
+        if content_type not in deletions:
+            await message.reply(f"Удаление {content_type} не идёт.")
+            return
+        jobs = [deletions[content_type]]
+    else:
+        jobs = list(deletions.values())
+    if not jobs:
+        await message.reply("Удалений не идёт.")
+        return
+    for job in jobs:
+        job.task.cancel()
+    await message.reply("Удаление остановлено. Уже удалённые пачки не восстанавливаются.")
 
 
 @dp.message_handler(commands=['get_all_video_ids'])
@@ -926,46 +1189,28 @@ async def stop_broadcasting(message: types.Message, state: FSMContext):
 
 @dp.message_handler(state=BroadcastState.broadcasting, content_types=types.ContentType.ANY)
 async def broadcast_message(message: types.Message, state: FSMContext):
+    # Вид вложения и file_id одни на всю рассылку — определяем до цикла
+    kind = MEDIA_KINDS.get(message.content_type)
+    file_id = kind.file_id(message) if kind else None
+    # Соединение только на выборку: рассылка под лимитером длится минутами
     async with db_pool.acquire() as conn:
         users = await conn.fetch("SELECT user_id FROM bot_users")
-        count = 0
-        for user in users:
-            try:
-                # Проверяем тип содержимого сообщения
-                if message.content_type == 'text':
-                    await bot.send_message(chat_id=user['user_id'], text=message.text)
-
-                elif message.content_type == 'photo':
-                    await bot.send_photo(chat_id=user['user_id'], photo=message.photo[-1].file_id,
-                                         caption=message.caption)
-
-                elif message.content_type == 'video':
-                    await bot.send_video(chat_id=user['user_id'], video=message.video.file_id, caption=message.caption)
-
-                elif message.content_type == 'animation':
-                    await bot.send_animation(chat_id=user['user_id'], animation=message.animation.file_id,
-                                             caption=message.caption)
-
-                elif message.content_type == 'document':
-                    await bot.send_document(chat_id=user['user_id'], document=message.document.file_id,
-                                            caption=message.caption)
-
-                elif message.content_type == 'audio':
-                    await bot.send_audio(chat_id=user['user_id'], audio=message.audio.file_id, caption=message.caption)
-
-                elif message.content_type == 'voice':
-                    await bot.send_voice(chat_id=user['user_id'], voice=message.voice.file_id, caption=message.caption)
-
-                elif message.content_type == 'sticker':
-                    await bot.send_sticker(chat_id=user['user_id'], sticker=message.sticker.file_id)
-
-                else:
-                    await bot.send_message(chat_id=user['user_id'], text="Этот тип сообщения не поддерживается.")
+    count = 0
+    for user in users:
+        await api_limiter.acquire()
+        try:
+            # Проверяем тип содержимого сообщения
+            if message.content_type == 'text':
+                await bot.send_message(chat_id=user['user_id'], text=message.text)
+            elif kind is not None:
+                await kind.send(bot, user['user_id'], file_id, caption=message.caption)
+            else:
+                await bot.send_message(chat_id=user['user_id'], text="Этот тип сообщения не поддерживается.")
 
-                count += 1
+            count += 1
 
-            except Exception as e:
-                logging.error(f"Failed to send message to {user['user_id']}: {e}")
+        except Exception as e:
+            logger.error(f"Failed to send message to {user['user_id']}: {e}")
 
     await message.reply(f"Сообщение успешно отправлено {count} пользователям.")
 
@@ -974,12 +1219,39 @@ async def broadcast_message(message: types.Message, state: FSMContext):
 async def scheduled_daily_video():
     async with db_pool.acquire() as conn:
         users = await conn.fetch("SELECT user_id FROM bot_users")
-        for user in users:
-            try:
-                # Отправляем команду /video от имени бота
-                await dp.bot.send_message(chat_id=user['user_id'], text="/video")
-            except Exception as e:
-                logger.error(f"Ошибка при отправке ежедневного видео пользователю {user['user_id']}: {e}")
+    for user in users:
+        await api_limiter.acquire()
+        try:
+            # Отправляем команду /video от имени бота
+            await dp.bot.send_message(chat_id=user['user_id'], text="/video")
+        except Exception as e:
+            logger.error(f"Ошибка при отправке ежедневного видео пользователю {user['user_id']}: {e}")
+
+
+def toggle_profiler():
+    path = profiler.toggle(PROFILE_DIR)
+    if path:
+        logger.info(f"Профиль сохранён в {path}")
+    return path
+
+
+@dp.message_handler(commands=['profile'])
+async def profile_command(message: types.Message):
+    user_id = message.from_user.id
+    if user_id not in glava:
+        await message.reply("У вас нет прав на выполнение этой команды.")
+        return
+
+    path = toggle_profiler()
+    if path is None:
+        await message.reply("Профилировщик запущен. Повторите /profile, чтобы остановить и получить стеки.")
+        return
+    try:
+        await message.reply_document(types.InputFile(path),
+                                     caption="Стеки в формате flamegraph (collapsed stacks).")
+    except Exception as e:
+        logger.error(f"Ошибка при отправке профиля: {e}")
+        await message.reply(f"Профиль сохранён в {path}")
 
 
 @dp.message_handler(commands=['content_count'])
@@ -1014,20 +1286,133 @@ async def content_count(message: types.Message):
         await message.reply(f"Не удалось получить статистику: {e}")
 
 
+async def rebuild_recommendations():
+    try:
+        await recommend.run_batch(db_pool, top_k=RECOMMEND_TOP_K, neighbors=RECOMMEND_NEIGHBORS,
+                                  memory_mb=RECOMMEND_MEMORY_MB)
+    except Exception as e:
+        logger.error(f"Ошибка при пересчёте рекомендаций: {e}")
+
+
+async def maintain_partitions():
+    try:
+        await retention.maintain(db_pool, retention_months=USER_CONTENT_RETENTION_MONTHS,
+                                 months_ahead=PARTITIONS_AHEAD)
+    except Exception as e:
+        logger.error(f"Ошибка при обслуживании секций user_content: {e}")
+
+
+async def warm_statements():
+    # Готовим горячие запросы на каждом соединении пула заранее, а не на первом апдейте
+    midnight = datetime.combine(datetime.now().date(), datetime.min.time())
+
+    async def warm(conn):
+        await conn.fetchval(QUOTA_QUERY, 0, "video", "command", midnight)
+        await conn.fetchrow(FEEDBACK_QUERY, "", "video")
+        for content_type, kind in CONTENT_TYPES.items():
+            await conn.fetchrow(kind.by_id_query, 0)
+            if CONTENT_SELECTION == 'recommended':
+                await recommend.pick_recommended(conn, content_type, 0, "command")
+
+    connections = [await db_pool.acquire() for _ in range(db_pool.get_min_size())]
+    try:
+        await asyncio.gather(*(warm(conn) for conn in connections))
+    finally:
+        for conn in connections:
+            await db_pool.release(conn)
+
+
+async def warm_keyboards():
+    keyboard_cache.subscription_keyboard(PUBLIC_CHANNELS)
+
+
+async def warm_partitions():
+    async with db_pool.acquire() as conn:
+        await retention.ensure_partitions(conn, PARTITIONS_AHEAD)
+
+
+async def start_polling(allowed_updates):
+    # Вебхук снимаем сами (это делал бы start_polling), чтобы готовность отметить
+    # непосредственно перед первым getUpdates, а не при создании задачи
+    await dp.reset_webhook(check=False)
+    lifecycle.mark_ready()
+    await dp.start_polling(reset_webhook=False, allowed_updates=allowed_updates)
+
+
 async def main():
+    lifecycle.install_signal_handlers()
     # Инициализация базы данных
     await init_db_pool()
-    await create_tables()
-    await update_tables()
+    await ensure_schema(db_pool, SCHEMA_VERSION, migrate_schema)
+    warm_tasks = {
+        'statements': warm_statements(),
+        'keyboards': warm_keyboards(),
+        'partitions': warm_partitions(),
+        'bot': bot.me,
+    }
+    if MEMBERSHIP_EVENTS:
+        warm_tasks['channels'] = membership.resolve(PUBLIC_CHANNELS)
+    if CONTENT_SELECTION in ('ranked', 'recommended'):
+        warm_tasks['ranking'] = ranking.warm(db_pool)
+    await warm_up(warm_tasks)
     aiocron.crontab('0 12 * * *')(scheduled_daily_video)
+    aiocron.crontab(PARTITION_MAINTENANCE_CRON)(maintain_partitions)
+    if RECOMMEND_CRON:
+        aiocron.crontab(RECOMMEND_CRON)(rebuild_recommendations)
+    try:
+        # kill -USR1 <pid> включает/выключает профилировщик
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, toggle_profiler)
+    except (NotImplementedError, AttributeError):
+        logger.warning("SIGUSR1 недоступен, профилировщик переключается только командой /profile.")
+    periodic = []
+    if CONTENT_SELECTION in ('ranked', 'recommended'):
+        periodic.append(asyncio.create_task(
+            ranking.run(db_pool, interval=RANKING_REFRESH_SECONDS, resync_interval=RANKING_RESYNC_SECONDS)))
+    if FILE_CHECK_RATE:
+        periodic.append(asyncio.create_task(file_validator.run(db_pool)))
+    if MEMBERSHIP_EVENTS and MEMBERSHIP_CHECK_RATE:
+        periodic.append(asyncio.create_task(membership.run(PUBLIC_CHANNELS)))
+    metrics_runner = None
+    if METRICS_PORT:
+        metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT, metrics)
     # Запуск бота
+    # chat_member Telegram присылает, только если запросить его явно
+    allowed_updates = types.AllowedUpdates.MESSAGE + types.AllowedUpdates.CALLBACK_QUERY
+    if MEMBERSHIP_EVENTS:
+        allowed_updates += types.AllowedUpdates.CHAT_MEMBER
+    polling = asyncio.create_task(start_polling(allowed_updates))
+    stop = asyncio.create_task(lifecycle.wait_stop())
     try:
-        await dp.start_polling()
+        await asyncio.wait({polling, stop}, return_when=asyncio.FIRST_COMPLETED)
     finally:
+        deadline = perf_counter() + SHUTDOWN_TIMEOUT
+        # Новые апдейты больше не берём; незавершённый getUpdates отменяем —
+        # неподтверждённые апдейты Telegram отдаст при следующем запуске
+        dp.stop_polling()
+        stop.cancel()
+        polling.cancel()
+        await asyncio.gather(polling, stop, return_exceptions=True)
+        # Дожидаемся уже начатых апдейтов, затем сбрасываем буферы
+        await lifecycle.wait_idle(deadline - perf_counter())
+        for task in periodic:
+            task.cancel()
+        await run_with_deadline('edit_scheduler', edit_scheduler.flush(), deadline)
+        # Удаления прерываем: уже удалённые пачки закоммичены, остаток можно запустить заново
+        deletion_tasks = [job.task for job in deletions.values()]
+        for task in deletion_tasks:
+            task.cancel()
+        await run_with_deadline('deletions', asyncio.gather(*deletion_tasks, return_exceptions=True), deadline)
+        # Даём фоновым задачам закончить работу с базой
+        await background.drain(timeout=max(deadline - perf_counter(), 0))
+        await asyncio.gather(*periodic, return_exceptions=True)
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await dp.storage.close()
+        await (await bot.get_session()).close()
         await close_db_pool()
+        logger.info("Бот остановлен.")
 
 
 if __name__ == '__main__':
     # Запуск основного цикла событий
     asyncio.run(main())
-    executor.start_polling(dp, skip_updates=True)  # Рекомендуется для большинства случаев
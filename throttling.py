@@ -0,0 +1,84 @@
+# Защита от флуда: token bucket на каждого пользователя.
+# Проверка стоит в pre_process — до фильтров, проверки подписки и походов в
+# базу, так что лишние нажатия почти ничего не стоят. Память ограничена:
+# корзины лежат в OrderedDict в порядке последнего обращения, простаивающие
+# (уже снова полные) выбрасываются с головы, сверх max_users — самые старые.
+# Не ограничиваются сообщения в состоянии FSM: это ответы на вопрос бота
+# (рассылка, добавление контента), их терять нельзя.
+from collections import OrderedDict
+from time import monotonic
+
+from aiogram.dispatcher.handler import CancelHandler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+
+class UserThrottle:
+    def __init__(self, rate: float = 1.0, burst: float = 5.0, max_users: int = 100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        # За это время пустая корзина наполняется целиком — такую запись можно забыть
+        self.idle = burst / rate
+        self.dropped = 0
+        # user_id -> [токены, время обновления, предупреждён ли о флуде]
+        self._buckets = OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _evict(self, now):
+        buckets = self._buckets
+        while buckets:
+            bucket = next(iter(buckets.values()))
+            if now - bucket[1] < self.idle and len(buckets) <= self.max_users:
+                break
+            buckets.popitem(last=False)
+
+    def hit(self, user_id: int, now: float = None):
+        # True — пропустить; False — отбросить (первый раз за серию); None — отбросить молча
+        now = monotonic() if now is None else now
+        bucket = self._buckets.pop(user_id, None)
+        if bucket is None:
+            bucket = [self.burst, now, False]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        self._buckets[user_id] = bucket
+        self._evict(now)
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            bucket[2] = False
+            return True
+        self.dropped += 1
+        if bucket[2]:
+            return None
+        bucket[2] = True
+        return False
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    def __init__(self, throttle: UserThrottle, message_text: str = "Не так быстро 🙂"):
+        super().__init__()
+        self.throttle = throttle
+        self.message_text = message_text
+
+    async def on_pre_process_message(self, message, data):
+        # Медиа (добавление контента, рассылка) не трогаем — дорогие только команды и кнопки меню
+        if not message.text:
+            return
+        if await self.manager.dispatcher.storage.get_state(chat=message.chat.id, user=message.from_user.id):
+            return
+        verdict = self.throttle.hit(message.from_user.id)
+        if verdict:
+            return
+        if verdict is False:
+            # Предупреждаем один раз за серию, чтобы сам ответ не стал флудом
+            await message.answer(self.message_text)
+        raise CancelHandler()
+
+    async def on_pre_process_callback_query(self, callback_query, data):
+        if self.throttle.hit(callback_query.from_user.id):
+            return
+        # На колбэк отвечаем всегда, иначе у пользователя крутятся «часики»
+        await callback_query.answer(self.message_text)
+        raise CancelHandler()
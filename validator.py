@@ -0,0 +1,101 @@
+# Проверка file_id в каталоге.
+# file_id со временем протухают (файл удалён, бот пересоздан), и тогда
+# send_video/send_photo падают с 400. Фоновая задача с ограниченной скоростью
+# дёргает get_file по давно не проверенным записям и помечает мёртвые
+# (dead_at), а выбор контента их пропускает. send_content помечает запись
+# мёртвой сам, если отправка упала с ошибкой file_id.
+import asyncio
+import logging
+
+from aiogram.utils.exceptions import BadRequest, FileIsTooBig, RetryAfter, TypeOfFileMismatch, \
+    WrongFileIdentifier, WrongRemoteFileIdSpecified
+
+from ratelimit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+DEAD_FILE_ERRORS = (WrongFileIdentifier, WrongRemoteFileIdSpecified, TypeOfFileMismatch)
+
+
+def is_dead_file_error(e: Exception) -> bool:
+    if isinstance(e, DEAD_FILE_ERRORS):
+        return True
+    # get_file отвечает «invalid file_id», у которого нет своего класса в aiogram
+    if isinstance(e, BadRequest) and not isinstance(e, FileIsTooBig):
+        text = str(e).lower()
+        return 'file_id' in text or 'file identifier' in text
+    return False
+
+
+async def mark_dead(conn, table_name: str, uids):
+    return await conn.execute(f"""
+        UPDATE {table_name} SET dead_at = NOW(), checked_at = NOW()
+        WHERE id = ANY($1::INT[]) AND dead_at IS NULL
+    """, list(uids))
+
+
+class FileValidator:
+    def __init__(self, bot, tables: dict, rate: float = 1.0, batch: int = 100, recheck_days: float = 7.0,
+                 on_dead=None):
+        self.bot = bot
+        self.tables = tables
+        self.limiter = RateLimiter(rate)
+        self.batch = batch
+        self.recheck_days = recheck_days
+        self.on_dead = on_dead
+        self.checked = 0
+        self.dead = 0
+
+    async def validate_batch(self, pool, content_type: str) -> int:
+        table_name = self.tables[content_type]
+        # Соединение не держим, пока идут медленные запросы к Bot API
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(f"""
+                SELECT id, {content_type}_id AS file_id FROM {table_name}
+                WHERE dead_at IS NULL
+                AND (checked_at IS NULL OR checked_at < NOW() - $1 * INTERVAL '1 day')
+                ORDER BY checked_at NULLS FIRST, id
+                LIMIT $2
+            """, self.recheck_days, self.batch)
+        alive, dead = [], []
+        for row in rows:
+            await self.limiter.acquire()
+            try:
+                await self.bot.get_file(row['file_id'])
+                alive.append(row['id'])
+            except FileIsTooBig:
+                # get_file не отдаёт файлы больше 20 МБ, но сам file_id рабочий
+                alive.append(row['id'])
+            except RetryAfter as e:
+                self.limiter.pause(e.timeout)
+                break
+            except Exception as e:
+                if not is_dead_file_error(e):
+                    logger.error(f"Ошибка при проверке {content_type} {row['id']}: {e}")
+                    break
+                dead.append(row['id'])
+        if alive or dead:
+            async with pool.acquire() as conn:
+                await conn.execute(f"UPDATE {table_name} SET checked_at = NOW() WHERE id = ANY($1::INT[])", alive)
+                await mark_dead(conn, table_name, dead)
+        self.checked += len(alive) + len(dead)
+        self.dead += len(dead)
+        if dead:
+            logger.warning(f"Недоступные {content_type}: {len(dead)} шт. помечены и исключены из выдачи.")
+            if self.on_dead:
+                self.on_dead(content_type, dead)
+        return len(alive) + len(dead)
+
+    async def run(self, pool, idle_interval: float = 300.0):
+        while True:
+            checked = 0
+            try:
+                for content_type in self.tables:
+                    checked += await self.validate_batch(pool, content_type)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка при проверке file_id: {e}")
+            if not checked:
+                # Всё проверено недавно — ждём, пока записи устареют
+                await asyncio.sleep(idle_interval)